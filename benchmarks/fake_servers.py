@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-ins for the Telegram Bot API and the Cryptomus API.
+
+Both speak just enough HTTP/1.1 (with keep-alive) for python-telegram-bot
+and the bot's Cryptomus client, answer instantly or after a configurable
+latency, and count every call so benchmarks can verify the traffic.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import time
+import uuid as uuid_lib
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🌐 KEEP-ALIVE HTTP SERVER
+# ═══════════════════════════════════════════════════════════════════════
+
+class FakeHTTPServer:
+    """Minimal keep-alive HTTP/1.1 server; subclasses implement handle()"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Keep-alive clients may still hold connections open
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        raise NotImplementedError
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = (await reader.readline()).decode("latin-1")
+                    if line in ("\r\n", "\n", ""):
+                        break
+                    key, _, value = line.partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, payload = await self.handle(method, path.split("?", 1)[0], headers, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+def parse_body(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """Decode a JSON or form-encoded request body (PTB sends JSON-encoded form values)"""
+    if not body:
+        return {}
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body.decode("utf-8"))
+    params: Dict[str, Any] = {}
+    for key, value in parse_qsl(body.decode("utf-8")):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🤖 FAKE TELEGRAM BOT API
+# ═══════════════════════════════════════════════════════════════════════
+
+class FakeTelegramServer(FakeHTTPServer):
+    """
+    Fake Bot API at http://host:port/bot<token>/<method>.
+    Sending to a chat id listed in blocked_chats raises 403 like a user
+    who blocked the bot.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blocked_chats: set = set()
+        self._message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def _message(self, chat_id: Any, text: str = "") -> Dict[str, Any]:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": text,
+        }
+
+    async def handle(self, method, path, headers, body):
+        api_method = path.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = parse_body(headers, body)
+
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                "can_join_groups": False, "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }}
+        if api_method in ("answerCallbackQuery", "deleteWebhook", "setWebhook", "deleteMessage"):
+            return 200, {"ok": True, "result": True}
+
+        chat_id = params.get("chat_id", 0)
+        if int(chat_id or 0) in self.blocked_chats:
+            return 403, {"ok": False, "error_code": 403,
+                         "description": "Forbidden: bot was blocked by the user"}
+        if api_method in ("sendMessage", "editMessageText", "copyMessage",
+                          "sendPhoto", "sendVideo", "sendDocument"):
+            return 200, {"ok": True, "result": self._message(chat_id, str(params.get("text", "")))}
+        if api_method == "sendMediaGroup":
+            return 200, {"ok": True, "result": [self._message(chat_id)]}
+        return 200, {"ok": True, "result": True}
+
+# ═══════════════════════════════════════════════════════════════════════
+# 💰 FAKE CRYPTOMUS API
+# ═══════════════════════════════════════════════════════════════════════
+
+class FakeCryptomusServer(FakeHTTPServer):
+    """
+    Fake Cryptomus at http://host:port/v1.
+    Every paid_every-th status check reports "paid", the rest "pending".
+    With api_key set, requests whose "sign" header is not
+    md5(base64(body) + api_key) are rejected with 401 like the real API.
+    """
+
+    def __init__(self, *args, paid_every: int = 10, api_key: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.paid_every = paid_every
+        self.api_key = api_key
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def handle(self, method, path, headers, body):
+        if self.api_key is not None:
+            expected = hashlib.md5(base64.b64encode(body) + self.api_key.encode("utf-8")).hexdigest()
+            if headers.get("sign") != expected:
+                self.calls["bad_sign"] += 1
+                return 401, {"state": 1, "message": "Invalid sign"}
+        params = parse_body(headers, body)
+        if path.endswith("/payment/info"):
+            self.calls["payment_info"] += 1
+            paid = self.paid_every and self.calls["payment_info"] % self.paid_every == 0
+            return 200, {"state": 0, "result": {
+                "uuid": params.get("uuid"),
+                "payment_status": "paid" if paid else "pending",
+            }}
+        if path.endswith("/payment"):
+            self.calls["payment"] += 1
+            invoice_id = str(uuid_lib.uuid4())
+            return 200, {"state": 0, "result": {
+                "uuid": invoice_id,
+                "order_id": params.get("order_id"),
+                "amount": params.get("amount"),
+                "url": f"https://pay.example/{invoice_id}",
+                "payment_status": "check",
+            }}
+        return 404, {"state": 1, "message": "Not found"}
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local end-to-end check of multi-worker mode.
+
+Starts the fake Bot API, runs `python main.py` with "workers": N in a
+temporary directory and acts as the update source: it POSTs synthetic
+/start updates to the front's webhook endpoint, exactly like Telegram.
+It then checks that
+
+    every update was answered exactly once,
+    exactly one worker holds the leader lease, and
+    (with --failover, Linux only) after the leader is killed a live
+    worker holds the lease again (another one, or the restarted slot).
+
+    python benchmarks/multiworker.py --workers 4 --chats 500 --failover
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import httpx
+
+from fake_servers import FakeTelegramServer
+from run import BOT_TOKEN, USER_ID_BASE, UpdateFactory
+
+SECRET = "multiworker-secret"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def leader_owner(db_path: str) -> Optional[str]:
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'lease:leader'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    if not row:
+        return None
+    lease = json.loads(row[0])
+    return lease["owner"] if lease.get("expires", 0) > time.time() else None
+
+def worker_pid(index: int) -> Optional[int]:
+    """Find a worker process by its BOT_WORKER_INDEX environment variable (Linux /proc)"""
+    marker = f"BOT_WORKER_INDEX={index}".encode()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/environ", "rb") as f:
+                if marker in f.read().split(b"\0"):
+                    return int(entry)
+        except OSError:
+            continue
+    return None
+
+async def wait_for(predicate, timeout: float, interval: float = 0.2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        await asyncio.sleep(interval)
+    return None
+
+async def run(args) -> int:
+    telegram = FakeTelegramServer()
+    await telegram.start()
+
+    workdir = tempfile.mkdtemp(prefix="bot-workers-")
+    port = free_port()
+    with open(os.path.join(workdir, "bot_token.txt"), "w", encoding="utf-8") as f:
+        f.write(BOT_TOKEN)
+    with open(os.path.join(workdir, "bot_config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "mode": "webhook",
+            "workers": args.workers,
+            "listen": "127.0.0.1",
+            "port": port,
+            "url_path": "telegram",
+            "secret_token": SECRET,
+            "api_base_url": telegram.base_url,
+        }, f)
+
+    env = dict(os.environ, BOT_STORAGE="sqlite")
+    front = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "main.py")],
+        cwd=workdir, env=env, stdin=subprocess.DEVNULL,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    failures = []
+    db_path = os.path.join(workdir, "bot.db")
+    try:
+        # Workers are up once every one of them has called getMe
+        if not await wait_for(lambda: telegram.calls["getMe"] >= args.workers, args.startup_timeout):
+            raise SystemExit("❌ Workers did not start")
+
+        # 🧪 Fake update source: one /start per chat, posted like Telegram would
+        factory = UpdateFactory()
+        url = f"http://127.0.0.1:{port}/telegram"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30) as client:
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def post(update):
+                async with semaphore:
+                    r = await client.post(url, json=update, headers=headers)
+                    return r.status_code
+
+            codes = await asyncio.gather(*(
+                post(factory.command(USER_ID_BASE + i, "/start")) for i in range(args.chats)
+            ))
+            bad = await client.post(url, json=factory.command(1, "/start"), headers={})
+        if any(code != 200 for code in codes):
+            failures.append(f"front rejected {sum(c != 200 for c in codes)} updates")
+        if bad.status_code != 403:
+            failures.append(f"update without secret got {bad.status_code}, expected 403")
+
+        answered = await wait_for(lambda: telegram.calls["sendMessage"] >= args.chats, 60)
+        elapsed = time.perf_counter() - start
+        if not answered or telegram.calls["sendMessage"] != args.chats:
+            failures.append(f"{telegram.calls['sendMessage']} replies for {args.chats} updates")
+        print(f"📨 {args.chats} updates over {args.workers} workers in {elapsed:.2f}s "
+              f"({args.chats / elapsed:.0f}/s)")
+
+        leader = await wait_for(lambda: leader_owner(db_path), 30)
+        print(f"👑 Leader: {leader}")
+        if not leader:
+            failures.append("no worker holds the leader lease")
+
+        if args.failover and leader and os.path.isdir("/proc"):
+            pid = worker_pid(int(leader.rsplit("-", 1)[1]))
+            if pid:
+                os.kill(pid, signal.SIGKILL)
+
+                def live_leader():
+                    # Either another worker or the restarted process of the same slot
+                    owner = leader_owner(db_path)
+                    new_pid = owner and worker_pid(int(owner.rsplit("-", 1)[1]))
+                    return new_pid and new_pid != pid and f"{owner} (pid {new_pid})"
+
+                new_leader = await wait_for(live_leader, 60)
+                print(f"👑 After killing {leader} (pid {pid}): {new_leader}")
+                if not new_leader:
+                    failures.append("leadership was not taken over")
+    finally:
+        front.send_signal(signal.SIGTERM)
+        try:
+            front.wait(60)
+        except subprocess.TimeoutExpired:
+            front.kill()
+            failures.append("front did not shut down")
+        await telegram.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Multi-worker mode OK")
+    return 1 if failures else 0
+
+def main():
+    p = argparse.ArgumentParser(description="End-to-end check of multi-worker mode with a fake update source")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--chats", type=int, default=500, help="synthetic /start updates, one per chat")
+    p.add_argument("--concurrency", type=int, default=32, help="webhook requests in flight")
+    p.add_argument("--startup-timeout", type=float, default=120)
+    p.add_argument("--failover", action="store_true", help="kill the leader and wait for a new one")
+    p.add_argument("--verbose", action="store_true", help="show bot output")
+    sys.exit(asyncio.run(run(p.parse_args())))
+
+if __name__ == "__main__":
+    main()
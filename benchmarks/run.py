@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for main.py.
+
+Runs the real Application (same handlers as production) against local
+fake Telegram Bot API and Cryptomus servers and replays synthetic load:
+
+    start       N /start commands from distinct users
+    refresh     refresh storm: every user taps "Refresh" several times
+    payment     "Make Payment" taps (invoice creation + reuse)
+    broadcast   broadcast to a seeded user base (--broadcast-content
+                text, copy of a photo message, or a 3-photo album)
+    poll        one polling cycle over seeded pending invoices
+    flood       one user hammering "Refresh" and "Make Payment" while
+                --flood-users others tap once (always behind the flood guard)
+
+Updates go through the Application's update_queue with the production
+builder settings, so they are handled exactly as in a worker process.
+Each scenario reports count, duration, throughput, p50/p99/max latency
+(enqueue to handler completion), its own peak RSS and the API calls it
+caused, as JSON:
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --output after.json --compare before.json
+
+Everything runs in a temporary working directory (removed afterwards
+unless --keep-workdir), so real bot data is never touched.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_servers import FakeCryptomusServer, FakeTelegramServer
+
+SCENARIOS = ("start", "refresh", "payment", "broadcast", "poll", "flood")
+BOT_TOKEN = "123456:BENCHMARK"
+ADMIN_CHAT_ID = 1
+USER_ID_BASE = 10_000_000
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📊 MEASUREMENT
+# ═══════════════════════════════════════════════════════════════════════
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss() -> bool:
+    """Start a new peak-RSS window (Linux: writing 5 to clear_refs resets VmHWM)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def current_rss_mb() -> Optional[float]:
+    return _proc_status_mb("VmRSS")
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size since the last reset_peak_rss(). Without
+    /proc this is the process-lifetime peak (ru_maxrss is KiB on Linux,
+    bytes on macOS).
+    """
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class Recorder:
+    """Collects per-operation latencies for one scenario"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    async def timed(self, coro: Awaitable):
+        start = time.perf_counter()
+        try:
+            return await coro
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def wrap(self, func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        async def wrapper(*args, **kwargs):
+            return await self.timed(func(*args, **kwargs))
+        return wrapper
+
+    def report(self, duration: float, count: Optional[int] = None) -> Dict[str, Any]:
+        values = sorted(self.latencies)
+        count = len(values) if count is None else count
+        return {
+            "count": count,
+            "errors": self.errors,
+            "duration_s": round(duration, 3),
+            "throughput_per_s": round(count / duration, 1) if duration > 0 else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(values, 50) * 1000, 3),
+                "p99": round(percentile(values, 99) * 1000, 3),
+                "max": round((values[-1] if values else 0.0) * 1000, 3),
+            },
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🧪 SYNTHETIC UPDATES
+# ═══════════════════════════════════════════════════════════════════════
+
+class UpdateFactory:
+    """Builds Bot API update dicts for the scenarios"""
+
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def command(self, user_id: int, command: str) -> Dict[str, Any]:
+        self.message_id += 1
+        return {
+            "update_id": self._next(),
+            "message": {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": command,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+    def callback(self, user_id: int, data: str, message_id: int) -> Dict[str, Any]:
+        return {
+            "update_id": self._next(),
+            "callback_query": {
+                "id": str(self.update_id),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                    "text": "📢 Channels",
+                },
+            },
+        }
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🏃 BENCHMARK RUNNER
+# ═══════════════════════════════════════════════════════════════════════
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, bot_module):
+        self.args = args
+        self.bot = bot_module
+        self.telegram = FakeTelegramServer(latency=args.telegram_latency)
+        self.cryptomus = FakeCryptomusServer(latency=args.cryptomus_latency, paid_every=args.paid_every,
+                                             api_key="bench-key")
+        self.updates = UpdateFactory()
+        self.app = None
+
+    async def setup(self):
+        bot = self.bot
+        await self.telegram.start()
+        await self.cryptomus.start()
+
+        bot.ensure_files()
+        bot.save_json(bot.CRYPTO_CONFIG_FILE, {"api_key": "bench-key", "merchant_id": "bench-merchant"})
+        bot.config_cache.invalidate("crypto_config")
+        storage = bot.get_storage()
+        storage.save_groups({f"Channel {i}": f"https://t.me/channel_{i}" for i in range(self.args.groups)})
+        bot.config_cache.invalidate("groups")
+        bot.payment_ledger.ensure_loaded()
+
+        bot.cryptomus = bot.CryptomusClient(base_url=self.cryptomus.base_url)
+        # Production settings; updates arrive on update_queue as in a worker process
+        self.app = (
+            bot.application_builder(BOT_TOKEN, {"api_base_url": self.telegram.base_url})
+            .updater(None)
+            .build()
+        )
+        if not self.args.flood_guard:
+            # Measure the handlers themselves, not the production rate limits
+            bot.flood_guard = bot.FloodGuard(user_limits={}, global_limits={})
+        bot.register_handlers(self.app)
+        self._track_update_latency()
+        await self.app.initialize()
+        await self.app.start()
+
+    async def teardown(self):
+        if self.app is not None:
+            if self.app.running:
+                await self.app.stop()
+            await self.app.shutdown()
+        await self.bot.cryptomus.close()
+        self.bot.shutdown_executors()
+        self.bot.get_storage().close()
+        await self.telegram.stop()
+        await self.cryptomus.stop()
+
+    def _api_calls_since(self, before_tg: Dict[str, int], before_cm: Dict[str, int]) -> Dict[str, int]:
+        calls = {}
+        for server, before in ((self.telegram, before_tg), (self.cryptomus, before_cm)):
+            for name, n in server.calls.items():
+                if n - before.get(name, 0):
+                    calls[name] = n - before.get(name, 0)
+        return calls
+
+    async def measure(self, name: str, body: Callable[[Recorder], Awaitable[Optional[int]]]) -> Dict[str, Any]:
+        before_tg, before_cm = dict(self.telegram.calls), dict(self.cryptomus.calls)
+        recorder = Recorder()
+        gc.collect()
+        rss_before = current_rss_mb()
+        reset_peak_rss()
+        start = time.perf_counter()
+        count = await body(recorder)
+        result = recorder.report(time.perf_counter() - start, count)
+        if rss_before is not None:
+            result["rss_before_mb"] = rss_before
+            result["rss_growth_mb"] = round(result["peak_rss_mb"] - rss_before, 1)
+        result["api_calls"] = self._api_calls_since(before_tg, before_cm)
+        print(f"  {name:<10} {result['count']:>8} ops  {result['throughput_per_s']:>10.1f}/s  "
+              f"p50 {result['latency_ms']['p50']:.2f}ms  p99 {result['latency_ms']['p99']:.2f}ms  "
+              f"rss {result['peak_rss_mb']}MB", file=sys.stderr)
+        return result
+
+    def _track_update_latency(self):
+        """
+        Time each update from enqueue to the end of its handlers. Wraps
+        process_update and create_task so block=False handlers count
+        until their task finishes, without changing how PTB runs them.
+        """
+        app = self.app
+        self._enqueued: Dict[int, Tuple[float, Recorder]] = {}
+        self._pending_updates: Dict[int, asyncio.Future] = {}
+        process_update, create_task = app.process_update, app.create_task
+        spawned: List[asyncio.Task] = []
+
+        def tracking_create_task(coroutine, update=None, **kwargs):
+            task = create_task(coroutine, update=update, **kwargs)
+            if update is not None and getattr(update, "update_id", None) in self._enqueued:
+                spawned.append(task)
+            return task
+
+        async def tracking_process_update(update):
+            spawned.clear()
+            try:
+                await process_update(update)
+            finally:
+                entry = self._enqueued.pop(getattr(update, "update_id", None), None)
+                if entry is not None:
+                    self._finish_when_done(update.update_id, entry, list(spawned))
+
+        app.create_task = tracking_create_task
+        app.process_update = tracking_process_update
+
+    def _finish_when_done(self, update_id: int, entry: Tuple[float, Recorder], tasks: List[asyncio.Task]):
+        started, recorder = entry
+
+        def finish(_=None):
+            if all(t.done() for t in tasks):
+                recorder.latencies.append(time.perf_counter() - started)
+                recorder.errors += sum(1 for t in tasks if not t.cancelled() and t.exception() is not None)
+                waiter = self._pending_updates.pop(update_id, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(None)
+
+        if not tasks:
+            finish()
+        for task in tasks:
+            task.add_done_callback(finish)
+
+    async def replay(self, recorder: Recorder, updates: List[Dict[str, Any]]):
+        """Put updates on the running app's update_queue and wait until all are handled"""
+        from telegram import Update
+
+        loop = asyncio.get_running_loop()
+        bot = self.app.bot
+        waiters = []
+        for data in updates:
+            update = Update.de_json(data, bot)
+            waiters.append(self._pending_updates.setdefault(update.update_id, loop.create_future()))
+            self._enqueued[update.update_id] = (time.perf_counter(), recorder)
+            await self.app.update_queue.put(update)
+        await asyncio.gather(*waiters)
+
+    def _user_ids(self, n: int) -> List[int]:
+        return [USER_ID_BASE + i for i in range(n)]
+
+    # 🎬 Scenarios
+    async def scenario_start(self, recorder: Recorder):
+        updates = [self.updates.command(uid, "/start") for uid in self._user_ids(self.args.starts)]
+        await self.replay(recorder, updates)
+
+    async def scenario_refresh(self, recorder: Recorder):
+        users = self._user_ids(self.args.refresh_users)
+        updates = []
+        for _ in range(self.args.refresh_taps):
+            for uid in users:
+                data = random.choice(("refresh", "refresh:0", "refresh:1"))
+                updates.append(self.updates.callback(uid, data, message_id=uid))
+        await self.replay(recorder, updates)
+
+    async def scenario_payment(self, recorder: Recorder):
+        users = self._user_ids(self.args.payments)
+        # Every user taps twice: the second tap should reuse the first invoice
+        updates = [self.updates.callback(uid, "make_payment", message_id=uid) for uid in users * 2]
+        await self.replay(recorder, updates)
+
+    async def scenario_broadcast(self, recorder: Recorder) -> int:
+        bot = self.bot
+        seed_users(bot.get_storage(), self.args.broadcast_users)
+        bot.BROADCAST_RATE = self.args.broadcast_rate
+        bot.BROADCAST_PER_CHAT_INTERVAL = 0
+        bot.BROADCAST_PROGRESS_INTERVAL = 3600
+
+        photo = {"type": "photo", "file_id": "BENCH-PHOTO", "file_unique_id": "bench-photo", "caption": "📢 Benchmark"}
+        content = {
+            "text": {"type": "text", "text": "📢 Benchmark broadcast"},
+            "copy": {"type": "copy", "from_chat_id": ADMIN_CHAT_ID, "message_id": 1, "message": photo},
+            "album": {"type": "album", "items": [dict(photo, file_unique_id=f"bench-{i}") for i in range(3)]},
+        }[self.args.broadcast_content]
+        job = bot.BroadcastJob.new(content, ADMIN_CHAT_ID)
+        job._send_one = recorder.wrap(job._send_one)
+        await job.run(self.app.bot)
+        return job.state["total"]
+
+    async def scenario_poll(self, recorder: Recorder) -> int:
+        bot = self.bot
+        seed_pending_payments(bot.get_storage(), self.args.pending_invoices)
+        bot.payment_ledger.reload()
+
+        poller = bot.PaymentPoller()
+        poller._check = recorder.wrap(poller._check)
+        changes = await poller.run_cycle()
+        print(f"  poll: {len(changes)} invoices settled", file=sys.stderr)
+        return len(recorder.latencies)
+
+    async def scenario_flood(self, recorder: Recorder) -> int:
+        # The registered guard, switched to production limits for this scenario only
+        guard = self.bot.flood_guard
+        saved = dict(guard.__dict__)
+        guard.__init__()
+        spammer = USER_ID_BASE - 1
+        updates = [self.updates.callback(spammer, data, message_id=1)
+                   for data in ("refresh", "make_payment") * (self.args.flood_updates // 2)]
+        updates += [self.updates.callback(uid, "refresh", message_id=uid) for uid in self._user_ids(self.args.flood_users)]
+        random.shuffle(updates)
+        try:
+            await self.replay(recorder, updates)
+        finally:
+            dropped = dict(guard.dropped)
+            guard.__dict__.update(saved)
+        print(f"  flood: dropped {sum(dropped.values())}/{len(updates)} "
+              f"({', '.join(f'{k}/{r}={n}' for (k, r), n in sorted(dropped.items()))})", file=sys.stderr)
+        return len(updates)
+
+    async def run(self) -> Dict[str, Any]:
+        await self.setup()
+        results = {}
+        try:
+            for name in self.args.scenarios:
+                results[name] = await self.measure(name, getattr(self, f"scenario_{name}"))
+        finally:
+            await self.teardown()
+        return results
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🌱 SEED DATA
+# ═══════════════════════════════════════════════════════════════════════
+
+def seed_users(storage, n: int):
+    """Ensure user ids USER_ID_BASE .. USER_ID_BASE+n exist (bulk insert on SQLite)"""
+    ids = range(USER_ID_BASE, USER_ID_BASE + n)
+    joined = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = getattr(storage, "conn", None)
+    if conn is None:
+        for uid in ids:
+            storage.add_user(uid, f"User{uid}", f"user{uid}")
+        return
+    with storage._lock:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, name, username, joined_at) VALUES (?, ?, ?, ?)",
+            ((uid, f"User{uid}", f"user{uid}", joined) for uid in ids),
+        )
+        conn.execute("COMMIT")
+
+def seed_pending_payments(storage, n: int):
+    """Add n fresh pending invoices"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = [{
+        "user_id": USER_ID_BASE + i,
+        "username": f"user{USER_ID_BASE + i}",
+        "amount": 10,
+        "uuid": f"bench-{i:08d}",
+        "status": "pending",
+        "url": f"https://pay.example/bench-{i:08d}",
+        "date": now,
+    } for i in range(n)]
+    conn = getattr(storage, "conn", None)
+    if conn is None:
+        for record in records:
+            storage.add_payment(record)
+        return
+    fields = storage.PAYMENT_FIELDS
+    with storage._lock:
+        conn.execute("BEGIN")
+        conn.executemany(
+            f"INSERT OR IGNORE INTO payments ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+            (tuple(r.get(k) for k in fields) for r in records),
+        )
+        conn.execute("COMMIT")
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📝 REPORT
+# ═══════════════════════════════════════════════════════════════════════
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+def build_report(args: argparse.Namespace, results: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        import telegram
+        ptb_version = telegram.__version__
+    except Exception:
+        ptb_version = "unknown"
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "python_telegram_bot": ptb_version,
+            "storage": args.storage,
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep_workdir")},
+        },
+        "scenarios": results,
+    }
+
+def compare_reports(old: Dict[str, Any], new: Dict[str, Any]) -> str:
+    """Human-readable throughput / p99 change per scenario"""
+    lines = [f"{'scenario':<10} {'throughput':>22} {'p99 ms':>22}"]
+    for name, cur in new["scenarios"].items():
+        prev = old.get("scenarios", {}).get(name)
+        if not prev:
+            continue
+
+        def delta(a, b):
+            return f"{a:>8} → {b:<8}" + (f"{(b - a) / a * 100:+.0f}%" if a else "")
+
+        lines.append(
+            f"{name:<10} {delta(prev['throughput_per_s'], cur['throughput_per_s']):>22} "
+            f"{delta(prev['latency_ms']['p99'], cur['latency_ms']['p99']):>22}"
+        )
+    return "\n".join(lines)
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🚀 MAIN
+# ═══════════════════════════════════════════════════════════════════════
+
+def parse_args(argv=None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Benchmark main.py against fake Telegram and Cryptomus servers")
+    p.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    p.add_argument("--storage", choices=("sqlite", "files"), default=os.environ.get("BOT_STORAGE", "sqlite"))
+    p.add_argument("--starts", type=int, default=5000, help="/start updates")
+    p.add_argument("--refresh-users", type=int, default=1000, help="users in the refresh storm")
+    p.add_argument("--refresh-taps", type=int, default=5, help="refresh taps per user")
+    p.add_argument("--payments", type=int, default=1000, help="users tapping Make Payment (twice each)")
+    p.add_argument("--broadcast-users", type=int, default=100_000, help="broadcast recipients")
+    p.add_argument("--broadcast-rate", type=float, default=100_000, help="broadcast messages/s cap")
+    p.add_argument("--broadcast-content", choices=("text", "copy", "album"), default="text",
+                   help="what the broadcast sends")
+    p.add_argument("--flood-updates", type=int, default=2000, help="updates sent by the flooding user")
+    p.add_argument("--flood-users", type=int, default=1000, help="well-behaved users during the flood")
+    p.add_argument("--flood-guard", action="store_true",
+                   help="keep the production anti-flood limits in the other scenarios")
+    p.add_argument("--pending-invoices", type=int, default=10_000, help="pending invoices to poll")
+    p.add_argument("--paid-every", type=int, default=10, help="fake Cryptomus reports every Nth check as paid")
+    p.add_argument("--groups", type=int, default=60, help="channels shown in the welcome list")
+    p.add_argument("--telegram-latency", type=float, default=0.0, help="fake Bot API latency (s)")
+    p.add_argument("--cryptomus-latency", type=float, default=0.0, help="fake Cryptomus latency (s)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--output", help="write the JSON report here instead of stdout")
+    p.add_argument("--compare", help="previous JSON report to compare against")
+    p.add_argument("--keep-workdir", action="store_true", help="keep the temporary bot data directory")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    output = os.path.abspath(args.output) if args.output else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(workdir)
+    os.environ["BOT_STORAGE"] = args.storage
+    sys.path.insert(0, REPO_DIR)
+
+    import main as bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"🏁 Benchmarking in {workdir}", file=sys.stderr)
+    try:
+        results = asyncio.run(Benchmark(args, bot_module).run())
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = build_report(args, results)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"✅ Report written to {output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if compare:
+        with open(compare, "r", encoding="utf-8") as f:
+            print(compare_reports(json.load(f), report), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -12,72 +12,124 @@
 ║   • Cryptomus USDT payment integration                               ║
 ║   • Auto payment status polling (30s intervals)                      ║
 ║   • User statistics & payment analytics                              ║
-║   • Auto-install all required packages                               ║
+║   • Installs missing packages (skipped with BOT_ENV=production)      ║
 ║                                                                       ║
 ╚═══════════════════════════════════════════════════════════════════════╝
 """
 
+import time
+
+_MODULE_LOAD_STARTED = time.perf_counter()
+
 import sys
-import subprocess
 import os
 import json
 import logging
 import html
-from datetime import datetime
-import time
+import shutil
+import tempfile
+from typing import Dict, Any, List, Tuple, Optional
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import base64
+import importlib.util
+from urllib.parse import urlparse
+from datetime import datetime, timedelta
 import threading
 import asyncio
-from typing import Dict, Any, List, Tuple, Optional
+import functools
+import heapq
+import bisect
+from array import array
+import random
+import sqlite3
+import pickle
+import signal
+from collections import OrderedDict, Counter, deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks are in-process only
+    fcntl = None
+
+# Phases finished before StartupProfile exists: (name, perf_counter at end)
+_early_startup_marks: List[Tuple[str, float]] = [("stdlib imports", time.perf_counter())]
 
 # ═══════════════════════════════════════════════════════════════════════
 # 📦 AUTO-INSTALL REQUIRED PACKAGES
 # ═══════════════════════════════════════════════════════════════════════
 
+# Skip the dependency check entirely with BOT_ENV=production (deps come from
+# requirements.txt at build time); worker processes never run it.
+PRODUCTION = os.environ.get("BOT_ENV", "").lower() == "production" or bool(os.environ.get("BOT_WORKER_INDEX"))
+
+# pip requirement -> importable module name
+REQUIRED_PACKAGES = {
+    "python-telegram-bot==20.0": "telegram",
+    "httpx": "httpx",
+}
+
 def install_packages():
-    """Auto-install all required packages silently"""
-    print("🔧 Checking & installing required packages...")
-    packages = ["python-telegram-bot==20.0", "requests"]
-    
-    for pkg in packages:
-        pkg_name = pkg.split("==")[0].replace("-", "_")
-        try:
-            __import__(pkg_name)
-            print(f"  ✅ {pkg.split('==')[0]} - already installed")
-        except ImportError:
-            print(f"  📦 Installing {pkg}...")
-            subprocess.check_call(
-                [sys.executable, "-m", "pip", "install", pkg, "--quiet"],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            print(f"  ✅ {pkg.split('==')[0]} - installed successfully")
+    """Install missing required packages (found via find_spec, nothing is imported)"""
+    missing = [pkg for pkg, module in REQUIRED_PACKAGES.items() if importlib.util.find_spec(module) is None]
+    if not missing:
+        return
+
+    import subprocess
+
+    print("🔧 Installing missing packages...")
+    for pkg in missing:
+        print(f"  📦 Installing {pkg}...")
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "install", pkg, "--quiet"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        print(f"  ✅ {pkg.split('==')[0]} - installed successfully")
+    importlib.invalidate_caches()
 
-install_packages()
+if not PRODUCTION:
+    install_packages()
+    _early_startup_marks.append(("dependency check", time.perf_counter()))
 
 # ═══════════════════════════════════════════════════════════════════════
 # 📚 IMPORTS
 # ═══════════════════════════════════════════════════════════════════════
 
 from telegram import (
+    Bot,
     Update,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
+    InputMediaPhoto,
+    InputMediaVideo,
+    InputMediaDocument,
+    InputMediaAudio,
 )
 from telegram.ext import (
     ApplicationBuilder,
+    BasePersistence,
+    PersistenceInput,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     filters,
 )
-from telegram.constants import ParseMode
-from telegram.error import TimedOut, NetworkError
+from telegram.constants import ParseMode, ChatAction
+from telegram.error import TimedOut, NetworkError, RetryAfter, Forbidden, BadRequest
+
+import httpx
 
-import requests
+_early_startup_marks.append(("telegram & httpx imports", time.perf_counter()))
 
 # ═══════════════════════════════════════════════════════════════════════
 # ⚙️ CONFIGURATION & FILE PATHS
@@ -91,7 +143,135 @@ ADMIN_PASSWORD = "Faisal7788"
 # Payment system files
 CRYPTO_CONFIG_FILE = "cryptomus_config.json"     # {"api_key": "...", "merchant_id": "..."}
 PAYMENT_CONFIG_FILE = "payment_config.json"      # {"usdt": 10}
-PAYMENTS_FILE = "payments.json"                  # Payment records
+PAYMENTS_FILE = "payments.json"                  # Payment records (snapshot)
+PAYMENTS_LOG_FILE = "payments.log.jsonl"         # Append-only payment events since the snapshot
+
+# User roster index
+USER_INDEX_SORT_CHUNK = 65536      # IDs sorted at a time when the index is built
+USER_INDEX_MERGE_BATCH = 1024      # New IDs buffered before they are merged into the index
+
+# Cryptomus API client
+CRYPTOMUS_API_URL = "https://api.cryptomus.com/v1"
+CRYPTOMUS_CREATE_TIMEOUT = 20      # Seconds per invoice creation attempt
+CRYPTOMUS_INFO_TIMEOUT = 15        # Seconds per status check attempt
+CRYPTOMUS_MAX_RETRIES = 2          # Extra attempts on network errors / 5xx
+CRYPTOMUS_CREATE_DEADLINE = 30     # Seconds for invoice creation including all retries
+
+# Payment status poller
+POLL_INTERVAL = 30                 # Seconds between checks of a fresh invoice
+POLL_MAX_INTERVAL = 900            # Backoff ceiling for old invoices
+POLL_BACKOFF_AGE = 900             # Check interval doubles per this many seconds of age
+POLL_CONCURRENCY = 10              # Status checks in flight
+INVOICE_LIFETIME = 3 * 3600        # Pending invoices older than this are expired
+POLL_RECONCILE_INTERVAL = 600      # Slow sweep interval when the webhook is enabled
+LEDGER_RECENT_SIZE = 50            # Recent transactions kept for admin stats
+INVOICE_REUSE_WINDOW = 45 * 60     # A pending invoice younger than this is shown again instead of a new one
+
+# Cryptomus webhook receiver, enabled by "webhook_port" in cryptomus_config.json:
+# {"webhook_port": 8081, "webhook_listen": "0.0.0.0",
+#  "webhook_path": "/cryptomus/webhook", "webhook_url": "https://bot.example.com/cryptomus/webhook"}
+CRYPTOMUS_WEBHOOK_PATH = "/cryptomus/webhook"
+
+# Update delivery: long polling unless bot_config.json selects webhook mode, e.g.
+# {"mode": "webhook", "webhook_url": "https://bot.example.com/telegram",
+#  "listen": "0.0.0.0", "port": 8443, "secret_token": "...", "max_connections": 100}
+# Add "workers": N (N > 1, SQLite storage) to run a front webhook receiver that
+# shards updates by chat id over N worker processes; "api_base_url" points the
+# bot at a local Bot API server (or a fake one for testing).
+BOT_CONFIG_FILE = "bot_config.json"
+
+# Multi-worker mode (BOT_WORKER_INDEX is set by the front process for its workers)
+WORKER_INDEX = int(os.environ["BOT_WORKER_INDEX"]) if os.environ.get("BOT_WORKER_INDEX") else None
+WORKER_ID = f"worker-{WORKER_INDEX}" if WORKER_INDEX is not None else "main"
+WORKER_RESTART_DELAY = 2           # Seconds before a crashed worker is restarted
+LEADER_LEASE_TTL = 15              # Seconds a leader lease stays valid without renewal
+LEADER_RENEW_INTERVAL = 5          # Seconds between lease renewals / takeover attempts
+BROADCAST_LEASE_TTL = 60           # A broadcast whose runner stops renewing for this long is taken over
+SHARED_SYNC_INTERVAL = 1.0         # Seconds between checks for other workers' database writes
+SHARED_SYNC_OVERLAP = 60           # Re-read payments updated this many seconds before the last sync
+
+# Storage backend: "sqlite" (default) or "files" (legacy flat files)
+STORAGE_BACKEND = os.environ.get("BOT_STORAGE", "sqlite")
+DATABASE_FILE = "bot.db"
+
+# Channel buttons per keyboard page (Telegram allows at most 100 buttons per keyboard)
+CHANNELS_PER_PAGE = 40
+
+# Refresh button: ignore repeat taps from one user within this many seconds
+REFRESH_DEBOUNCE = 2.0
+SHOWN_VIEWS_LIMIT = 10000       # Messages whose displayed channel view is remembered
+
+# Payment event log (file storage backend)
+PAYMENT_LOG_FSYNC_BATCH = 20          # fsync after this many unsynced events...
+PAYMENT_LOG_FSYNC_INTERVAL = 1.0      # ...or once the oldest unsynced event is this old
+PAYMENT_LOG_COMPACT_EVENTS = 5000     # Compact into a snapshot past this many log events
+STORAGE_MAINTENANCE_INTERVAL = 60     # Seconds between storage maintenance runs
+
+# Executors for blocking work (threads per named queue, max queued jobs per queue)
+EXECUTOR_QUEUES = {"io": (8, 256), "cpu": (2, 64)}
+# Debug: log any loop callback that blocks longer than the threshold
+LOOP_DEBUG = os.environ.get("BOT_LOOP_DEBUG", "") == "1"
+SLOW_CALLBACK_THRESHOLD = 0.1
+
+# Prometheus metrics on http://METRICS_LISTEN:METRICS_PORT/metrics (disabled when port is 0)
+METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "0") or 0)
+if METRICS_PORT and WORKER_INDEX:
+    METRICS_PORT += WORKER_INDEX   # Worker i listens on BOT_METRICS_PORT + i
+METRICS_LISTEN = os.environ.get("BOT_METRICS_LISTEN", "127.0.0.1")
+
+# Seconds between mtime checks for manual edits of cached config files
+CONFIG_WATCH_INTERVAL = 5
+
+# PTB state (conversation states, user_data, chat_data, bot_data) survives restarts here
+PERSISTENCE_FILE = "bot_state.db"
+PERSISTENCE_UPDATE_INTERVAL = 10    # Seconds between incremental flushes of changed entries
+
+# Paid-notification outbox: status transitions enqueue events, a dispatcher delivers them
+OUTBOX_FILE = "outbox.json"         # Snapshot of pending events (files storage backend)...
+OUTBOX_LOG_FILE = "outbox.log.jsonl"  # ...plus an append-only log of changes since the snapshot
+OUTBOX_COMPACT_EVENTS = 1000        # Compact the outbox log past this many entries
+OUTBOX_DONE_KEYS = 10_000           # Keys of finished events remembered for de-duplication
+PAID_STATUSES = ("paid", "paid_over")
+OUTBOX_RATE = 20                    # Notifications/second
+OUTBOX_BATCH = 50                   # Events fetched per dispatch round
+OUTBOX_MAX_ATTEMPTS = 8             # Give up (status "failed") after this many tries
+OUTBOX_RETRY_BASE = 5               # Retry backoff: base * 2^attempts seconds...
+OUTBOX_RETRY_MAX = 1800             # ...capped here
+OUTBOX_IDLE_INTERVAL = 5            # Seconds between checks for due retries when idle
+
+# Broadcast engine
+BROADCAST_STATE_FILE = "broadcast_state.json"   # Checkpoint for resumable broadcasts
+BROADCAST_RATE = 25                 # Global messages/second (Telegram allows ~30)
+BROADCAST_CONCURRENCY = 20          # Parallel sends in flight
+BROADCAST_PER_CHAT_INTERVAL = 1.0   # Min seconds between messages to one chat
+BROADCAST_CHUNK = 100               # Users per checkpoint
+BROADCAST_PROGRESS_INTERVAL = 5     # Seconds between admin progress updates
+MEDIA_CACHE_FILE = "media_cache.json"  # Broadcast file_ids and the last campaign, kept across restarts
+MEDIA_CACHE_SIZE = 500              # file_ids remembered (oldest dropped first)
+
+# Dead recipients (users who blocked the bot or deleted their account)
+REACHABILITY_FILE = "reachability.json"  # Dead users for the file backend
+REPROBE_AFTER = 7 * 24 * 3600       # Re-check a dead user this long after the last attempt
+REPROBE_INTERVAL = 3600             # Seconds between re-probe rounds
+REPROBE_BATCH = 200                 # Dead users re-probed per round
+REPROBE_RATE = 1                    # Probes/second, well below the broadcast budget
+
+# Anti-flood: token buckets per update kind as (tokens/second, burst).
+# Per-user buckets stop one spammer; global ones (per process) cap a botnet.
+FLOOD_USER_LIMITS = {
+    "command": (0.5, 5),     # /start, /admin: file I/O and a send each
+    "payment": (0.1, 3),     # "Make Payment": may create a Cryptomus invoice
+    "callback": (1.0, 10),   # refresh / page buttons
+    "message": (2.0, 20),    # admin panel input (albums arrive in bursts)
+}
+FLOOD_GLOBAL_LIMITS = {
+    "command": (200, 400),
+    "payment": (20, 40),
+    "callback": (300, 600),
+    "message": (300, 600),
+}
+FLOOD_TRACKED_BUCKETS = 50_000     # Per-user buckets kept; least recently active are evicted
+FLOOD_REPORT_INTERVAL = 60         # Seconds between "dropped updates" log summaries
 
 # Conversation states
 (
@@ -119,6 +299,64 @@ def safe_html(text: str) -> str:
     """Escape HTML special characters"""
     return html.escape(text or "", quote=True)
 
+class StartupProfile:
+    """
+    Wall-clock time of each startup phase since the module started loading.
+    mark() closes the current phase; report() logs the breakdown once the
+    bot is ready (and records it as metrics when they are enabled).
+    """
+
+    def __init__(self, started: float, marks: Optional[List[Tuple[str, float]]] = None):
+        self.started = started
+        self.last = started
+        self.phases: List[Tuple[str, float]] = []
+        self.reported = False
+        for phase, at in marks or []:
+            self.mark(phase, at)
+
+    def mark(self, phase: str, at: Optional[float] = None):
+        now = time.perf_counter() if at is None else at
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        total = self.last - self.started
+        breakdown = ", ".join(f"{name} {secs * 1000:.0f}ms" for name, secs in self.phases)
+        logger.info(f"⏱️ Startup took {total:.2f}s: {breakdown}")
+        for name, secs in self.phases:
+            metrics.observe("bot_startup_phase_seconds", secs, phase=name)
+
+startup = StartupProfile(_MODULE_LOAD_STARTED, _early_startup_marks)
+
+class LRUCache:
+    """Small bounded mapping that evicts the least recently used key"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+            return self._data[key]
+        except KeyError:
+            return default
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
 def ensure_files():
     """Create all required files if they don't exist"""
     files_config = {
@@ -130,252 +368,3171 @@ def ensure_files():
     
     for fname, default_content in files_config.items():
         if not os.path.isfile(fname):
-            with open(fname, "w", encoding="utf-8") as f:
-                json.dump(default_content, f, ensure_ascii=False, indent=2)
+            save_json(fname, default_content, backup=False)
     
     if not os.path.isfile(USERS_FILE):
         open(USERS_FILE, "w", encoding="utf-8").close()
 
+_file_locks: Dict[str, threading.Lock] = {}
+_file_locks_guard = threading.Lock()
+
+@contextmanager
+def file_lock(fname: str):
+    """
+    Exclusive (non-reentrant) lock for writing fname.
+    Covers threads in this process and, where fcntl exists, other
+    processes via flock on a sidecar .lock file.
+    """
+    path = os.path.abspath(fname)
+    with _file_locks_guard:
+        lock = _file_locks.setdefault(path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{path}.lock", "a") as lf:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+def _fsync_dir(path: str):
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write_text(fname: str, text: str, fsync: bool = True, backup: bool = True):
+    """
+    Replace fname atomically: write a temp file in the same directory,
+    optionally fsync it, then os.replace over the target. With backup,
+    the previous version is kept as fname.bak for corruption recovery.
+    Callers must hold file_lock(fname).
+    """
+    directory = os.path.dirname(os.path.abspath(fname))
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(fname)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        if backup and os.path.isfile(fname):
+            bak_tmp = f"{fname}.bak.tmp"
+            try:
+                if os.path.exists(bak_tmp):
+                    os.remove(bak_tmp)
+                os.link(fname, bak_tmp)
+            except OSError:
+                shutil.copy2(fname, bak_tmp)
+            os.replace(bak_tmp, f"{fname}.bak")
+        os.replace(tmp, fname)
+        if fsync:
+            _fsync_dir(fname)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
 def load_json(fname: str, default=None):
-    """Load JSON file with error handling"""
+    """
+    Load JSON file with error handling.
+    A missing file gives the default. A corrupted file is moved aside
+    and restored from its .bak snapshot; defaults are only used when no
+    good snapshot exists.
+    """
+    fallback = {} if default is None else default
     try:
         with open(fname, "r", encoding="utf-8") as f:
             return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading {fname}: {e}")
-        return {} if default is None else default
+    except FileNotFoundError:
+        return fallback
+    except (ValueError, OSError) as e:
+        logger.error(f"❌ {fname} is corrupted: {e}")
+
+    with file_lock(fname):
+        # Keep the broken file for inspection so the next save can't destroy it
+        try:
+            os.replace(fname, f"{fname}.corrupt-{int(time.time())}")
+        except OSError:
+            pass
+        try:
+            with open(f"{fname}.bak", "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.error(f"❌ No usable backup for {fname}, using defaults")
+            return fallback
+        atomic_write_text(fname, json.dumps(data, indent=2, ensure_ascii=False), backup=False)
+    logger.warning(f"♻️ {fname} restored from last good snapshot")
+    return data
 
-def save_json(fname: str, data: Any):
-    """Save data to JSON file"""
-    with open(fname, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def save_json(fname: str, data: Any, fsync: bool = True, backup: bool = True):
+    """Save data to JSON file atomically (crash-safe)"""
+    text = json.dumps(data, indent=2, ensure_ascii=False)
+    with file_lock(fname):
+        atomic_write_text(fname, text, fsync=fsync, backup=backup)
 
 # ═══════════════════════════════════════════════════════════════════════
-# 👥 USER MANAGEMENT
+# ⚙️ EXECUTORS
 # ═══════════════════════════════════════════════════════════════════════
 
-def add_user(user_id: int, user_name: str, username: Optional[str] = None):
-    """Add new user to database"""
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
-    except:
-        lines = []
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = f"{user_id}|{user_name}|{username or 'N/A'}|{timestamp}"
-    
-    if not any(line.startswith(f"{user_id}|") for line in lines):
-        with open(USERS_FILE, "a", encoding="utf-8") as f:
-            f.write(entry + "\n")
-        logger.info(f"✨ New user joined: {user_name} (@{username}) - ID: {user_id}")
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_slots: Dict[str, asyncio.Semaphore] = {}
 
-def get_users() -> List[Tuple[str, str, str, str]]:
-    """Get all registered users"""
+def get_executor(queue: str) -> ThreadPoolExecutor:
+    """Thread pool for a named queue ("io" or "cpu"), created on first use"""
+    executor = _executors.get(queue)
+    if executor is None:
+        workers, _ = EXECUTOR_QUEUES[queue]
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bot-{queue}")
+        _executors[queue] = executor
+    return executor
+
+async def run_blocking(func, *args, queue: str = "io", **kwargs):
+    """
+    Run a blocking callable on a named executor queue without stalling
+    the event loop. Each queue admits a bounded number of pending jobs;
+    callers beyond that wait here instead of piling up in the pool.
+    """
+    slots = _executor_slots.get(queue)
+    if slots is None:
+        slots = _executor_slots[queue] = asyncio.Semaphore(EXECUTOR_QUEUES[queue][1])
+    async with slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(queue), functools.partial(func, *args, **kwargs))
+
+def to_async(func, queue: str = "io"):
+    """Async wrapper that runs func via run_blocking"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, queue=queue, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = f"{func.__name__}_async"
+    return wrapper
+
+def shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown(wait=True)
+    _executors.clear()
+    _executor_slots.clear()
+
+def enable_loop_debug(loop: asyncio.AbstractEventLoop):
+    """Have asyncio warn about callbacks blocking longer than SLOW_CALLBACK_THRESHOLD"""
+    loop.set_debug(True)
+    loop.slow_callback_duration = SLOW_CALLBACK_THRESHOLD
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.info(f"🐢 Loop debug on: reporting callbacks slower than {SLOW_CALLBACK_THRESHOLD}s")
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🧠 CONFIG CACHE
+# ═══════════════════════════════════════════════════════════════════════
+
+def _file_mtime(path: str) -> Optional[float]:
     try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            lines = f.read().splitlines()
-    except:
-        return []
-    
-    users = []
-    for line in lines:
-        parts = line.split("|")
-        if len(parts) == 4:
-            users.append(tuple(parts))
-    return users
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class ConfigCache:
+    """
+    Parsed config and groups held in memory.
+    Hot handlers read straight from memory. Entries are dropped on admin
+    writes (invalidate) and when a watched file's mtime changes; mtimes
+    are only checked by the background watch() task.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}
+        self._watched: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, loader, path: Optional[str] = None) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        # Record the mtime and version before loading so an edit or an
+        # invalidate() during the load is not missed
+        mtime = _file_mtime(path) if path else None
+        version = self._versions.get(key, 0)
+        value = loader()
+        with self._lock:
+            # Invalidated mid-load: the value may predate the write, serve it uncached
+            if self._versions.get(key, 0) == version:
+                self._values[key] = value
+                if path:
+                    self._watched[key] = (path, mtime)
+        return value
+
+    def version(self, key: str) -> int:
+        """Counter bumped every time key is invalidated"""
+        return self._versions.get(key, 0)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+            self._watched.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def check_files(self):
+        for key, (path, mtime) in list(self._watched.items()):
+            if _file_mtime(path) != mtime:
+                logger.info(f"🔄 {path} changed on disk, reloading")
+                self.invalidate(key)
+
+    async def watch(self, interval: float = CONFIG_WATCH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check_files()
+            except Exception as e:
+                logger.error(f"❌ Config watch error: {e}")
+
+config_cache = ConfigCache()
 
 # ═══════════════════════════════════════════════════════════════════════
-# 📋 GROUP/CHANNEL MANAGEMENT
+# 🌐 EMBEDDED HTTP SERVER
 # ═══════════════════════════════════════════════════════════════════════
 
-def load_groups() -> Dict[str, str]:
-    """Load all groups/channels"""
-    ensure_files()
-    return load_json(GROUPS_FILE, {})
+class MiniHTTPServer:
+    """
+    Minimal asyncio HTTP/1.1 server for internal endpoints.
+    Handlers are coroutines taking (body, headers) and returning
+    (status, content_type, payload). One request per connection.
+    """
 
-def save_groups(data: Dict[str, str]):
-    """Save groups/channels to file"""
-    save_json(GROUPS_FILE, data)
+    MAX_BODY = 1024 * 1024
+    REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.routes: Dict[Tuple[str, str], Any] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler):
+        self.routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"🌐 HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _respond(self, writer, status: int, content_type: str, payload: bytes):
+        head = (
+            f"HTTP/1.1 {status} {self.REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await asyncio.wait_for(reader.readline(), 10)).decode("latin-1").split()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0].upper(), request_line[1].split("?", 1)[0]
+
+            headers: Dict[str, str] = {}
+            while True:
+                line = (await asyncio.wait_for(reader.readline(), 10)).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length") or 0)
+            if length > self.MAX_BODY:
+                await self._respond(writer, 413, "text/plain", b"too large")
+                return
+            body = await asyncio.wait_for(reader.readexactly(length), 10) if length else b""
+
+            handler = self.routes.get((method, path))
+            if handler is None:
+                known = any(p == path for _, p in self.routes)
+                await self._respond(writer, 405 if known else 404, "text/plain", b"")
+                return
+            try:
+                status, content_type, payload = await handler(body, headers)
+            except Exception as e:
+                logger.error(f"❌ HTTP handler {path} failed: {e}")
+                status, content_type, payload = 500, "text/plain", b"error"
+            await self._respond(writer, status, content_type, payload)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📈 METRICS
+# ═══════════════════════════════════════════════════════════════════════
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
 
-def build_channels_keyboard(groups: Dict[str, str]) -> InlineKeyboardMarkup:
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            # bot_handler_duration_seconds -> bot_handler_errors_total
+            base = self.name.rsplit("_seconds", 1)[0].rsplit("_duration", 1)[0]
+            self.metrics.inc(f"{base}_errors_total", **self.labels)
+        return False
+
+class Metrics:
     """
-    Build beautiful 2-column channel button grid
-    Like the image you shared - rounded URL buttons in 2 columns
+    In-process counters and histograms in Prometheus text format.
+    Every recording call returns immediately while disabled.
     """
-    rows = []
-    items = list(groups.items())
-    
-    # Create 2-column grid of channel buttons
-    for i in range(0, len(items), 2):
-        row = []
-        for j in range(2):
-            if i + j < len(items):
-                name, link = items[i + j]
-                row.append(InlineKeyboardButton(text=str(name), url=str(link)))
-        rows.append(row)
-    
-    # Add action buttons below channel grid
-    rows.append([InlineKeyboardButton("💸 Make Payment", callback_data="make_payment")])
-    rows.append([InlineKeyboardButton("🔄 Refresh Channels", callback_data="refresh")])
-    
-    return InlineKeyboardMarkup(rows)
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.enabled = False
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+                break
+        hist[1] += seconds
+        hist[2] += 1
+
+    def timer(self, name: str, **labels):
+        """Context manager observing elapsed seconds (and errors) into name"""
+        if not self.enabled:
+            return nullcontext()
+        return _Timer(self, name, labels)
+
+    @staticmethod
+    def _labels(pairs, extra: str = "") -> str:
+        parts = [f'{k}="{str(v)}"' for k, v in pairs]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in sorted(self._histograms.items()):
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS, buckets):
+                cumulative += n
+                le = self._labels(labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            le = self._labels(labels, 'le="+Inf"')
+            lines.append(f"{name}_bucket{le} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def instrument_handler(name: str, callback):
+    """Wrap a handler callback to record its latency and errors"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with _Timer(metrics, "bot_handler_duration_seconds", {"handler": name}):
+            return await callback(update, context)
+    return wrapper
+
+async def handle_metrics(body: bytes, headers: Dict[str, str]):
+    return 200, "text/plain; version=0.0.4", metrics.render().encode("utf-8")
+
+_metrics_server: Optional["MiniHTTPServer"] = None
+
+async def start_metrics_server():
+    global _metrics_server
+    if not METRICS_PORT:
+        return
+    server = MiniHTTPServer(METRICS_LISTEN, METRICS_PORT)
+    server.route("GET", "/metrics", handle_metrics)
+    await server.start()
+    _metrics_server = server
+
+async def stop_metrics_server():
+    global _metrics_server
+    if _metrics_server is not None:
+        await _metrics_server.stop()
+        _metrics_server = None
 
 # ═══════════════════════════════════════════════════════════════════════
-# 💰 CRYPTOMUS PAYMENT SYSTEM
+# 🗄️ STORAGE BACKENDS
 # ═══════════════════════════════════════════════════════════════════════
 
-def get_crypto_config():
-    """Get Cryptomus API configuration"""
-    ensure_files()
-    config = load_json(CRYPTO_CONFIG_FILE, {})
-    if not config.get("api_key") or not config.get("merchant_id"):
+class Storage(ABC):
+    """
+    Storage backend interface for users, groups and payments.
+    Every write is a single-record operation; only save_groups replaces
+    the full set (kept for bulk edits and the file backend).
+    """
+
+    # File holding groups, watched for manual edits (None if not file-based)
+    groups_path: Optional[str] = None
+
+    # 👥 Users
+    @abstractmethod
+    def add_user(self, user_id: int, user_name: str, username: Optional[str]) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_users(self) -> List[Tuple[str, str, str, str]]:
+        raise NotImplementedError
+
+    def get_recent_users(self, limit: int) -> List[Tuple[str, str, str, str]]:
+        return self.get_users()[-limit:]
+
+    def get_user_ids(self) -> array:
+        """All user IDs in join order, as a compact int64 array"""
+        return array("q", (int(u[0]) for u in self.get_users() if u[0].strip().isdigit()))
+
+    def count_users(self) -> int:
+        return len(self.get_users())
+
+    # 📋 Groups
+    @abstractmethod
+    def load_groups(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_groups(self, data: Dict[str, str]):
+        raise NotImplementedError
+
+    def set_group(self, name: str, link: str):
+        groups = self.load_groups()
+        groups[name] = link
+        self.save_groups(groups)
+
+    def delete_group(self, name: str) -> bool:
+        groups = self.load_groups()
+        if name not in groups:
+            return False
+        groups.pop(name)
+        self.save_groups(groups)
+        return True
+
+    # 💰 Payments
+    @abstractmethod
+    def get_payments(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_payment(self, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_payment_status(self, uuid: str, new_status: str, updated_at: str) -> bool:
+        """True if the payment exists and was updated"""
+        raise NotImplementedError
+
+    def update_payment_statuses(self, updates: List[Tuple[str, str]], updated_at: str,
+                                events: Optional[List[Dict[str, Any]]] = None) -> int:
+        """Write status changes plus the outbox events they trigger; returns payments updated"""
+        updated = sum(self.update_payment_status(uuid, new_status, updated_at) for uuid, new_status in updates)
+        if events:
+            self.enqueue_events(events)
+        return updated
+
+    @abstractmethod
+    def get_payment_changes(self, after_id: int, since: str) -> Tuple[List[Dict[str, Any]], int]:
+        """Payments added after row after_id or updated at/after since, and the new max row id"""
+        raise NotImplementedError
+
+    # 📬 Outbox (events: {"event_key", "kind", "chat_id", "payload"}; event_key is unique)
+    @abstractmethod
+    def enqueue_events(self, events: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_due_events(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        """Pending events whose next attempt is due, oldest first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_events(self, results: List[Dict[str, Any]], finished_at: str):
+        """Apply delivery results: {"id", "status", "attempts", "next_attempt_at", "last_error"}"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def outbox_counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    # 📵 Reachability: last delivery outcome per user ("reachable" or "dead")
+    @abstractmethod
+    def record_reachability(self, outcomes: List[Tuple[int, str]], at: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_dead_user_ids(self) -> array:
+        """Sorted IDs of users currently marked dead"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_reprobe_candidates(self, before: float, limit: int) -> List[int]:
+        """Dead users whose last delivery attempt is older than `before`"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_dead_users(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def revive_user(self, user_id: int) -> bool:
+        """Mark a dead user reachable again; True if they were dead"""
+        raise NotImplementedError
+
+    # 🧩 Multi-process coordination (single-process backends own everything)
+    def data_version(self) -> Optional[int]:
+        """Changes whenever another process commits to the shared store (None if not shared)"""
         return None
-    return config
 
-def get_payment_amount() -> int:
-    """Get current payment amount in USDT"""
-    ensure_files()
-    data = load_json(PAYMENT_CONFIG_FILE, {})
-    try:
-        return int(data.get("usdt", 10))
-    except:
-        return 10
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew the named lease for ttl seconds; False while someone else holds it"""
+        return True
 
-def set_payment_amount_value(amount: int):
-    """Set new payment amount"""
-    save_json(PAYMENT_CONFIG_FILE, {"usdt": int(amount)})
+    def release_lease(self, name: str, owner: str):
+        pass
 
-def get_payments() -> List[Dict[str, Any]]:
-    """Get all payment records"""
-    ensure_files()
-    try:
-        with open(PAYMENTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return []
+    def maintain(self):
+        """Periodic housekeeping (flush, compaction)"""
+        pass
 
-def save_payments(payments: List[Dict[str, Any]]):
-    """Save payment records"""
-    save_json(PAYMENTS_FILE, payments)
+    def close(self):
+        pass
 
-def add_payment(user_id: int, username: str, amount: int, uuid: str, status: str, url: str, date: str):
-    """Add new payment record"""
-    payments = get_payments()
-    payments.append({
-        "user_id": user_id,
-        "username": username,
-        "amount": amount,
-        "uuid": uuid,
-        "status": status,
-        "url": url,
-        "date": date,
-    })
-    save_payments(payments)
+class PaymentEventLog:
+    """
+    Payment records as a JSON snapshot plus an append-only JSONL event log.
+
+    Writes append one "created" or "status" event instead of rewriting
+    the whole history; fsyncs are batched. On open the snapshot is loaded
+    and the log replayed (a torn last line from a crash is ignored).
+    compact() writes a fresh snapshot and truncates the log. An existing
+    payments.json simply becomes the initial snapshot.
+    """
+
+    def __init__(self, snapshot_path: str, log_path: str):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._log_events = 0
+        self._unsynced = 0
+        self._first_unsynced = 0.0
+        self._sync_timer: Optional[threading.Timer] = None
+        self._fh = None
+        self._needs_newline = False
+        self._load()
+
+    def _key(self, record: Dict[str, Any]) -> str:
+        return record.get("uuid") or f"_legacy_{len(self._records)}"
+
+    def _apply(self, event: Dict[str, Any]):
+        kind = event.get("e")
+        if kind == "created":
+            record = event.get("p") or {}
+            key = self._key(record)
+            # Replaying after a compaction crash can repeat creations
+            if key not in self._records:
+                self._records[key] = record
+        elif kind == "status":
+            record = self._records.get(event.get("uuid"))
+            if record is not None:
+                record["status"] = event.get("status")
+                record["updated_at"] = event.get("at")
+
+    def _load(self):
+        snapshot = load_json(self.snapshot_path, []) if os.path.isfile(self.snapshot_path) else []
+        for record in snapshot if isinstance(snapshot, list) else []:
+            if isinstance(record, dict):
+                self._records[self._key(record)] = record
+
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._needs_newline = not line.endswith("\n")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._apply(json.loads(line))
+                        self._log_events += 1
+                    except ValueError:
+                        logger.warning(f"⚠️ Skipping torn line in {self.log_path}")
+        except FileNotFoundError:
+            pass
+
+    def has(self, uuid: str) -> bool:
+        return uuid in self._records
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(r) for r in self._records.values()]
+
+    def append(self, events: List[Dict[str, Any]]):
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.log_path, "a", encoding="utf-8")
+            if self._needs_newline:
+                self._fh.write("\n")
+                self._needs_newline = False
+            for event in events:
+                self._apply(event)
+                self._fh.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._fh.flush()
+            self._log_events += len(events)
+            if not self._unsynced:
+                self._first_unsynced = time.monotonic()
+                # Honour the age limit even if no further event arrives
+                self._sync_timer = threading.Timer(PAYMENT_LOG_FSYNC_INTERVAL, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+            self._unsynced += len(events)
+            if (self._unsynced >= PAYMENT_LOG_FSYNC_BATCH
+                    or time.monotonic() - self._first_unsynced >= PAYMENT_LOG_FSYNC_INTERVAL):
+                self.sync()
+
+    def sync(self):
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._unsynced and self._fh is not None:
+                os.fsync(self._fh.fileno())
+                self._unsynced = 0
+
+    def compact(self):
+        """Write a snapshot of the current state and truncate the log"""
+        with self._lock:
+            self.sync()
+            save_json(self.snapshot_path, list(self._records.values()))
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self.log_path, "w", encoding="utf-8")
+            self._needs_newline = False
+            self._log_events = 0
+        logger.info(f"🗜️ Payment log compacted ({len(self._records)} payments)")
+
+    def maybe_compact(self):
+        if self._log_events >= PAYMENT_LOG_COMPACT_EVENTS:
+            self.compact()
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+class OutboxLog:
+    """
+    Outbox events for the file backend: a snapshot holding only pending
+    events plus an append-only JSONL log of enqueues and results.
+
+    Every append is fsynced, so an event is durable before the payment
+    status that caused it is written. Finished events leave memory and
+    the next snapshot. Only their counts and the most recent
+    OUTBOX_DONE_KEYS event keys are kept, so re-enqueueing a recently
+    sent notification is still ignored.
+    """
+
+    def __init__(self, snapshot_path: str, log_path: str):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.next_id = 1
+        self._pending: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._pending_keys: set = set()
+        self._done_keys: "OrderedDict[str, None]" = OrderedDict()
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._log_events = 0
+        self._fh = None
+        self._needs_newline = False
+        self._load()
+
+    def _finish(self, event: Dict[str, Any]):
+        self._pending.pop(event["id"], None)
+        self._pending_keys.discard(event["event_key"])
+        self._counts[event["status"]] += 1
+        self._done_keys[event["event_key"]] = None
+        while len(self._done_keys) > OUTBOX_DONE_KEYS:
+            self._done_keys.popitem(last=False)
+
+    def _add(self, event: Dict[str, Any]):
+        self.next_id = max(self.next_id, event["id"] + 1)
+        if event["status"] != "pending":
+            self._finish(event)
+        elif event["event_key"] not in self._pending_keys:
+            self._pending[event["id"]] = event
+            self._pending_keys.add(event["event_key"])
+
+    def _apply(self, entry: Dict[str, Any]):
+        if entry.get("e") == "enqueue":
+            self._add(entry["event"])
+        elif entry.get("e") == "finish":
+            event = self._pending.get(entry["r"]["id"])
+            if event is not None:
+                event.update({k: entry["r"][k] for k in ("status", "attempts", "next_attempt_at", "last_error")})
+                if event["status"] == "sent":
+                    event["sent_at"] = entry.get("at")
+                if event["status"] != "pending":
+                    self._finish(event)
+
+    def _load(self):
+        # Older versions kept every event, finished or not, in the snapshot
+        data = load_json(self.snapshot_path, {}) if os.path.isfile(self.snapshot_path) else {}
+        self.next_id = int(data.get("next_id", 1))
+        self._counts.update(data.get("counts", {}))
+        for key in data.get("done_keys", []):
+            self._done_keys[key] = None
+        for event in data.get("events", []):
+            self._add(event)
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._needs_newline = not line.endswith("\n")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._apply(json.loads(line))
+                        self._log_events += 1
+                    except (ValueError, KeyError):
+                        logger.warning(f"⚠️ Skipping torn line in {self.log_path}")
+        except FileNotFoundError:
+            pass
+
+    def _append(self, entries: List[Dict[str, Any]]):
+        if self._fh is None:
+            self._fh = open(self.log_path, "a", encoding="utf-8")
+        if self._needs_newline:
+            self._fh.write("\n")
+            self._needs_newline = False
+        for entry in entries:
+            self._fh.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._log_events += len(entries)
+
+    def enqueue(self, events: List[Dict[str, Any]]):
+        with self._lock:
+            now = time.time()
+            created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            entries = []
+            for event in events:
+                key = event["event_key"]
+                if key in self._pending_keys or key in self._done_keys:
+                    continue
+                record = {
+                    **event, "id": self.next_id, "status": "pending", "attempts": 0,
+                    "next_attempt_at": now, "last_error": None, "created_at": created, "sent_at": None,
+                }
+                self._add(record)
+                entries.append({"e": "enqueue", "event": record})
+            if entries:
+                self._append(entries)
+
+    def due(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            due = [dict(e) for e in self._pending.values() if e["next_attempt_at"] <= now]
+            return due[:limit]
+
+    def finish(self, results: List[Dict[str, Any]], finished_at: str):
+        with self._lock:
+            entries = [{"e": "finish", "r": r, "at": finished_at} for r in results if r["id"] in self._pending]
+            for entry in entries:
+                self._apply(entry)
+            if entries:
+                self._append(entries)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {k: v for k, v in self._counts.items() if v}
+            if self._pending:
+                counts["pending"] = len(self._pending)
+            return counts
+
+    def compact(self):
+        """Snapshot the pending events and truncate the log"""
+        with self._lock:
+            save_json(self.snapshot_path, {
+                "next_id": self.next_id,
+                "counts": dict(self._counts),
+                "done_keys": list(self._done_keys),
+                "events": list(self._pending.values()),
+            }, backup=False)
+            if self._fh is not None:
+                self._fh.close()
+            self._fh = open(self.log_path, "w", encoding="utf-8")
+            self._needs_newline = False
+            self._log_events = 0
+
+    def maybe_compact(self):
+        if self._log_events >= OUTBOX_COMPACT_EVENTS:
+            self.compact()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+class FileStorage(Storage):
+    """Legacy backend: users.txt, groups.json and payments.json"""
+
+    groups_path = GROUPS_FILE
+
+    def __init__(self):
+        ensure_files()
+        self.users = UserStore(USERS_FILE)
+        self.users.load()
+        self.payments = PaymentEventLog(PAYMENTS_FILE, PAYMENTS_LOG_FILE)
+        self.payments.maybe_compact()
+        self.outbox = OutboxLog(OUTBOX_FILE, OUTBOX_LOG_FILE)
+        self.outbox.maybe_compact()
+        self._dead_data: Optional[Dict[str, float]] = None
+        self._dead_lock = threading.Lock()
+
+    def add_user(self, user_id, user_name, username):
+        return self.users.add(user_id, user_name, username)
+
+    def get_users(self):
+        return self.users.profiles()
+
+    def get_recent_users(self, limit):
+        return self.users.recent(limit)
+
+    def get_user_ids(self):
+        return self.users.ids()
+
+    def count_users(self):
+        return len(self.users)
+
+    def load_groups(self):
+        ensure_files()
+        return load_json(GROUPS_FILE, {})
+
+    def save_groups(self, data):
+        save_json(GROUPS_FILE, data)
+
+    def get_payments(self):
+        return self.payments.records()
+
+    def add_payment(self, record):
+        self.payments.append([{"e": "created", "p": dict(record)}])
+
+    def update_payment_status(self, uuid, new_status, updated_at):
+        return self.update_payment_statuses([(uuid, new_status)], updated_at) > 0
+
+    def update_payment_statuses(self, updates, updated_at, events=None):
+        log_events = [
+            {"e": "status", "uuid": uuid, "status": new_status, "at": updated_at}
+            for uuid, new_status in updates
+            if self.payments.has(uuid)
+        ]
+        # Outbox first: if we crash in between, the ledger still shows the old
+        # status, the transition is seen again and the re-enqueue is a no-op
+        if events:
+            self.enqueue_events(events)
+        if log_events:
+            self.payments.append(log_events)
+        return len(log_events)
+
+    def get_payment_changes(self, after_id, since):
+        # Row ids are 1-based positions in the ledger, which only ever grows
+        records = self.payments.records()
+        changed = [
+            r for i, r in enumerate(records, 1)
+            if i > after_id or (r.get("updated_at") is not None and r["updated_at"] >= since)
+        ]
+        return changed, len(records)
+
+    # 📬 Outbox
+    def enqueue_events(self, events):
+        self.outbox.enqueue(events)
+
+    def get_due_events(self, now, limit):
+        return self.outbox.due(now, limit)
+
+    def finish_events(self, results, finished_at):
+        self.outbox.finish(results, finished_at)
+
+    def outbox_counts(self):
+        return self.outbox.counts()
+
+    # 📵 Reachability: only dead users are stored ({user_id: last attempt})
+    def _dead(self) -> Dict[str, float]:
+        if self._dead_data is None:
+            self._dead_data = {str(k): float(v) for k, v in load_json(REACHABILITY_FILE, {}).items()}
+        return self._dead_data
+
+    def record_reachability(self, outcomes, at):
+        with self._dead_lock:
+            dead = self._dead()
+            changed = False
+            for user_id, state in outcomes:
+                key = str(user_id)
+                if state == "dead":
+                    dead[key] = at
+                    changed = True
+                elif dead.pop(key, None) is not None:
+                    changed = True
+            if changed:
+                save_json(REACHABILITY_FILE, dead, backup=False)
+
+    def get_dead_user_ids(self):
+        with self._dead_lock:
+            return array("q", sorted(int(k) for k in self._dead()))
+
+    def get_reprobe_candidates(self, before, limit):
+        with self._dead_lock:
+            due = sorted((at, int(k)) for k, at in self._dead().items() if at < before)
+        return [user_id for _, user_id in due[:limit]]
+
+    def count_dead_users(self):
+        with self._dead_lock:
+            return len(self._dead())
+
+    def revive_user(self, user_id):
+        with self._dead_lock:
+            if str(user_id) not in self._dead():
+                return False
+        self.record_reachability([(user_id, "reachable")], time.time())
+        return True
+
+    def maintain(self):
+        self.payments.sync()
+        self.payments.maybe_compact()
+        self.outbox.maybe_compact()
+
+    def close(self):
+        if self.payments._log_events:
+            self.payments.compact()
+        self.payments.close()
+        self.outbox.close()
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite backend (WAL mode).
+    One shared connection guarded by a lock, so the polling thread and
+    async handlers can both use it safely. Worker processes open the same
+    file; SQLite's file locks serialise their writes and meta-table
+    leases pick the process that runs singleton jobs.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            name TEXT,
+            username TEXT,
+            joined_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS groups (
+            name TEXT PRIMARY KEY,
+            link TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL UNIQUE,
+            user_id INTEGER,
+            username TEXT,
+            amount INTEGER,
+            status TEXT,
+            url TEXT,
+            date TEXT,
+            updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
+        CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);
+        CREATE INDEX IF NOT EXISTS idx_payments_updated ON payments(updated_at);
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TEXT,
+            sent_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+        CREATE TABLE IF NOT EXISTS reachability (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_reachability_state ON reachability(state, updated_at);
+    """
+
+    PAYMENT_FIELDS = ("user_id", "username", "amount", "uuid", "status", "url", "date", "updated_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        self._execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    # 👥 Users
+    @staticmethod
+    def _user_row(r: sqlite3.Row) -> Tuple[str, str, str, str]:
+        return (str(r["user_id"]), r["name"] or "", r["username"] or "N/A", r["joined_at"] or "")
+
+    def add_user(self, user_id, user_name, username):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cur = self._execute(
+            "INSERT OR IGNORE INTO users (user_id, name, username, joined_at) VALUES (?, ?, ?, ?)",
+            (int(user_id), user_name, username or "N/A", timestamp),
+        )
+        return cur.rowcount > 0
+
+    def get_users(self):
+        rows = self._query("SELECT user_id, name, username, joined_at FROM users ORDER BY id")
+        return [self._user_row(r) for r in rows]
+
+    def get_recent_users(self, limit):
+        rows = self._query(
+            "SELECT user_id, name, username, joined_at FROM users ORDER BY id DESC LIMIT ?",
+            (int(limit),),
+        )
+        return [self._user_row(r) for r in reversed(rows)]
+
+    def get_user_ids(self):
+        ids = array("q")
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.row_factory = None
+            cur.execute("SELECT user_id FROM users ORDER BY id")
+            while True:
+                rows = cur.fetchmany(10_000)
+                if not rows:
+                    break
+                ids.extend(r[0] for r in rows)
+        return ids
+
+    def count_users(self):
+        return self._query("SELECT COUNT(*) AS n FROM users")[0]["n"]
+
+    # 📋 Groups
+    def load_groups(self):
+        rows = self._query("SELECT name, link FROM groups ORDER BY rowid")
+        return {r["name"]: r["link"] for r in rows}
+
+    def save_groups(self, data):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM groups")
+                self.conn.executemany(
+                    "INSERT INTO groups (name, link) VALUES (?, ?)",
+                    [(str(k), str(v)) for k, v in data.items()],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def set_group(self, name, link):
+        self._execute(
+            "INSERT INTO groups (name, link) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET link = excluded.link",
+            (name, link),
+        )
+
+    def delete_group(self, name):
+        return self._execute("DELETE FROM groups WHERE name = ?", (name,)).rowcount > 0
+
+    # 💰 Payments
+    def _payment_row(self, r: sqlite3.Row) -> Dict[str, Any]:
+        record = {k: r[k] for k in self.PAYMENT_FIELDS}
+        if record["updated_at"] is None:
+            record.pop("updated_at")
+        return record
+
+    def get_payments(self):
+        rows = self._query(f"SELECT {', '.join(self.PAYMENT_FIELDS)} FROM payments ORDER BY id")
+        return [self._payment_row(r) for r in rows]
+
+    def add_payment(self, record):
+        self._execute(
+            f"INSERT OR IGNORE INTO payments ({', '.join(self.PAYMENT_FIELDS)}) "
+            f"VALUES ({', '.join('?' * len(self.PAYMENT_FIELDS))})",
+            tuple(record.get(k) for k in self.PAYMENT_FIELDS),
+        )
+
+    def update_payment_status(self, uuid, new_status, updated_at):
+        cur = self._execute(
+            "UPDATE payments SET status = ?, updated_at = ? WHERE uuid = ?",
+            (new_status, updated_at, uuid),
+        )
+        return cur.rowcount > 0
+
+    def update_payment_statuses(self, updates, updated_at, events=None):
+        if not updates:
+            return 0
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self.conn.executemany(
+                    "UPDATE payments SET status = ?, updated_at = ? WHERE uuid = ?",
+                    [(status, updated_at, uuid) for uuid, status in updates],
+                )
+                # Same transaction: a status change and its notification commit together
+                if events:
+                    self._insert_events(events)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount
+
+    # 📬 Outbox
+    def _insert_events(self, events):
+        now = time.time()
+        created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO outbox (event_key, kind, chat_id, payload, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(e["event_key"], e["kind"], int(e["chat_id"]), json.dumps(e["payload"]), now, created)
+             for e in events],
+        )
+
+    def enqueue_events(self, events):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert_events(events)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_due_events(self, now, limit):
+        rows = self._query(
+            "SELECT id, event_key, kind, chat_id, payload, attempts FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+            (now, int(limit)),
+        )
+        return [{**dict(r), "payload": json.loads(r["payload"])} for r in rows]
+
+    def finish_events(self, results, finished_at):
+        if not results:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+                    "sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END WHERE id = ?",
+                    [(r["status"], r["attempts"], r["next_attempt_at"], r["last_error"],
+                      r["status"], finished_at, r["id"]) for r in results],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def outbox_counts(self):
+        rows = self._query("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status")
+        return {r["status"]: r["n"] for r in rows}
+
+    # 📵 Reachability
+    def record_reachability(self, outcomes, at):
+        if not outcomes:
+            return
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO reachability (user_id, state, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    [(int(user_id), state, at) for user_id, state in outcomes],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_dead_user_ids(self):
+        ids = array("q")
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.row_factory = None
+            cur.execute("SELECT user_id FROM reachability WHERE state = 'dead' ORDER BY user_id")
+            for rows in iter(lambda: cur.fetchmany(10_000), []):
+                ids.extend(r[0] for r in rows)
+        return ids
+
+    def get_reprobe_candidates(self, before, limit):
+        rows = self._query(
+            "SELECT user_id FROM reachability WHERE state = 'dead' AND updated_at < ? "
+            "ORDER BY updated_at LIMIT ?",
+            (before, int(limit)),
+        )
+        return [r["user_id"] for r in rows]
+
+    def count_dead_users(self):
+        return self._query("SELECT COUNT(*) AS n FROM reachability WHERE state = 'dead'")[0]["n"]
+
+    def revive_user(self, user_id):
+        # Read first: /start calls this for every returning user, most of them alive
+        if not self._query("SELECT 1 FROM reachability WHERE user_id = ? AND state = 'dead'", (int(user_id),)):
+            return False
+        cur = self._execute(
+            "UPDATE reachability SET state = 'reachable', updated_at = ? WHERE user_id = ? AND state = 'dead'",
+            (time.time(), int(user_id)),
+        )
+        return cur.rowcount > 0
+
+    def get_payment_changes(self, after_id, since):
+        with self._lock:
+            max_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM payments").fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.PAYMENT_FIELDS)} FROM payments WHERE id > ? AND id <= ? "
+                f"UNION SELECT {', '.join(self.PAYMENT_FIELDS)} FROM payments WHERE updated_at >= ?",
+                (int(after_id), max_id, since),
+            ).fetchall()
+        return [self._payment_row(r) for r in rows], max_id
+
+    # 🧩 Multi-process coordination
+    def data_version(self):
+        return self._query("PRAGMA data_version")[0][0]
+
+    def acquire_lease(self, name, owner, ttl):
+        key = f"lease:{name}"
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                try:
+                    holder = json.loads(row["value"]) if row else {}
+                except ValueError:
+                    holder = {}
+                free = not holder or holder.get("owner") == owner or float(holder.get("expires", 0)) < now
+                if free:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        (key, json.dumps({"owner": owner, "expires": now + ttl})),
+                    )
+                self.conn.execute("COMMIT")
+                return free
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def release_lease(self, name, owner):
+        self._execute(
+            "DELETE FROM meta WHERE key = ? AND json_extract(value, '$.owner') = ?",
+            (f"lease:{name}", owner),
+        )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+def migrate_files_to_sqlite(db: SQLiteStorage):
+    """
+    One-shot import of users.txt, groups.json and payments.json.
+    Runs inside a single transaction and is recorded in the meta table,
+    so it never runs twice. The original files are left untouched.
+    """
+    if db.get_meta("migrated_from_files"):
+        return
+
+    legacy = FileStorage()
+    users = legacy.get_users()
+    groups = legacy.load_groups()
+    payments = [p for p in legacy.get_payments() if isinstance(p, dict) and p.get("uuid")]
+
+    with db._lock:
+        db.conn.execute("BEGIN IMMEDIATE")
+        try:
+            db.conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id, name, username, joined_at) VALUES (?, ?, ?, ?)",
+                [(int(u[0]), u[1], u[2], u[3]) for u in users if u[0].strip().isdigit()],
+            )
+            db.conn.executemany(
+                "INSERT OR IGNORE INTO groups (name, link) VALUES (?, ?)",
+                [(str(k), str(v)) for k, v in groups.items()],
+            )
+            db.conn.executemany(
+                f"INSERT OR IGNORE INTO payments ({', '.join(db.PAYMENT_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(db.PAYMENT_FIELDS))})",
+                [tuple(p.get(k) for k in db.PAYMENT_FIELDS) for p in payments],
+            )
+            db.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_files', ?)",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+            )
+            db.conn.execute("COMMIT")
+        except Exception:
+            db.conn.execute("ROLLBACK")
+            raise
+
+    logger.info(
+        f"🗄️ Migrated to SQLite: {len(users)} users, {len(groups)} groups, {len(payments)} payments"
+    )
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+async def storage_maintenance():
+    """Background task running the backend's periodic housekeeping"""
+    while True:
+        await asyncio.sleep(STORAGE_MAINTENANCE_INTERVAL)
+        try:
+            await run_blocking(get_storage().maintain, queue="cpu")
+        except Exception as e:
+            logger.error(f"❌ Storage maintenance error: {e}")
+
+def get_storage() -> Storage:
+    """Return the configured storage backend (opened on first use)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "files":
+                    _storage = FileStorage()
+                else:
+                    db = SQLiteStorage(DATABASE_FILE)
+                    migrate_files_to_sqlite(db)
+                    _storage = db
+    return _storage
+
+# ═══════════════════════════════════════════════════════════════════════
+# 💾 BOT STATE PERSISTENCE
+# ═══════════════════════════════════════════════════════════════════════
+
+class SQLitePersistence(BasePersistence):
+    """
+    PTB persistence backed by its own SQLite file.
+    Every user_data/chat_data entry, bot_data and each conversation state
+    is one row, stored as JSON (pickle only for values JSON can't round-trip).
+    Every update_interval PTB hands over the entries touched since its
+    last run; unchanged ones are skipped and the rest are written in a
+    single transaction on the I/O executor.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            format TEXT NOT NULL,
+            value BLOB,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str = PERSISTENCE_FILE, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._written: Dict[Tuple[str, str], Tuple[str, Any]] = {}
+        self._pending: Dict[Tuple[str, str], Optional[Tuple[str, Any]]] = {}
+        self._flush_task: Optional["asyncio.Future"] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    # 🔧 Encoding
+    @staticmethod
+    def _encode(value: Any) -> Tuple[str, Any]:
+        try:
+            text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+            if json.loads(text) == value:
+                return "json", text
+        except (TypeError, ValueError):
+            pass
+        # e.g. int dict keys or tuples, which JSON would silently change
+        return "pickle", pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(fmt: str, value: Any) -> Any:
+        return pickle.loads(value) if fmt == "pickle" else json.loads(value)
+
+    # 🗄️ Database
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+        return self._conn
+
+    def _load_kind(self, kind: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._db().execute("SELECT key, format, value FROM state WHERE kind = ?", (kind,)).fetchall()
+        data = {}
+        for key, fmt, value in rows:
+            try:
+                data[key] = self._decode(fmt, value)
+            except Exception as e:
+                logger.error(f"❌ Skipping unreadable {kind} state {key}: {e}")
+                continue
+            self._written[(kind, key)] = (fmt, value)
+        return data
+
+    def _write(self, batch: Dict[Tuple[str, str], Optional[Tuple[str, Any]]]):
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (kind, key), row in batch.items():
+                    if row is None:
+                        conn.execute("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+                    else:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO state (kind, key, format, value) VALUES (?, ?, ?, ?)",
+                            (kind, key, row[0], row[1]),
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # ✍️ Incremental flushing
+    def _stage(self, kind: str, key: str, value: Any):
+        row_key = (kind, key)
+        if value is None:
+            if row_key in self._written:
+                self._pending[row_key] = None
+            else:
+                self._pending.pop(row_key, None)
+        else:
+            if isinstance(value, dict) and not value and row_key not in self._written:
+                self._pending.pop(row_key, None)   # Nothing stored yet, nothing to store
+                return
+            row = self._encode(value)
+            if self._written.get(row_key) == row:
+                self._pending.pop(row_key, None)
+            else:
+                self._pending[row_key] = row
+        # PTB gathers all update_* calls of one run; this flush runs after the whole batch
+        if self._pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self._flush_pending())
+
+    async def _flush_pending(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                await run_blocking(self._write, batch)
+            except BaseException as e:
+                # Keep the batch for the next run unless newer values arrived meanwhile
+                for row_key, row in batch.items():
+                    self._pending.setdefault(row_key, row)
+                if not isinstance(e, asyncio.CancelledError):
+                    logger.error(f"❌ Persisting bot state failed: {e}")
+                raise
+            for row_key, row in batch.items():
+                if row is None:
+                    self._written.pop(row_key, None)
+                else:
+                    self._written[row_key] = row
+
+    # 📥 Loading (once, during Application.initialize)
+    async def get_user_data(self) -> Dict[int, Any]:
+        data = await run_blocking(self._load_kind, "user")
+        return {int(k): v for k, v in data.items()}
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        data = await run_blocking(self._load_kind, "chat")
+        return {int(k): v for k, v in data.items()}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        data = await run_blocking(self._load_kind, "bot")
+        return data.get("", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        data = await run_blocking(self._load_kind, f"conv:{name}")
+        return {tuple(json.loads(k)): v for k, v in data.items()}
+
+    # 📤 Updates from PTB
+    async def update_conversation(self, name: str, key, new_state):
+        self._stage(f"conv:{name}", json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id: int, data):
+        self._stage("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data):
+        self._stage("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._stage("bot", "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        self._stage("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._stage("chat", str(chat_id), None)
+
+    # In-memory data is authoritative; nothing to refresh
+    async def refresh_user_data(self, user_id: int, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Write everything still pending (called by PTB on shutdown)"""
+        await self._flush_pending()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# ═══════════════════════════════════════════════════════════════════════
+# 👥 USER MANAGEMENT
+# ═══════════════════════════════════════════════════════════════════════
+
+def _sorted_unique(values: array) -> array:
+    """Sorted, de-duplicated copy of an int64 array, built from sorted chunks"""
+    runs = [array("q", sorted(values[i:i + USER_INDEX_SORT_CHUNK]))
+            for i in range(0, len(values), USER_INDEX_SORT_CHUNK)]
+    result = array("q")
+    last = None
+    for uid in heapq.merge(*runs):
+        if uid != last:
+            result.append(uid)
+            last = uid
+    return result
+
+class UserStore:
+    """
+    Registered users as a compact roster.
+
+    Only the IDs live in memory: array('q') in join order (what broadcasts
+    walk) plus a sorted copy for O(log n) duplicate checks, 16 bytes per
+    user. New IDs wait in a small sorted buffer that is merged into the
+    sorted copy in batches. Names, usernames and join dates stay in
+    USERS_FILE and are read lazily when someone asks for them. New users
+    are appended and fsynced immediately.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._order = array("q")
+        self._sorted = array("q")
+        self._new: List[int] = []
+        self._loaded = False
+        self._needs_newline = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)build the roster from the existing users file"""
+        order = array("q")
+        last_line = b""
+        try:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    last_line = line
+                    uid = line.split(b"|", 1)[0].strip()
+                    if uid.isdigit():
+                        order.append(int(uid))
+        except FileNotFoundError:
+            pass
+        index = _sorted_unique(order)
+        if len(index) != len(order):
+            # Hand-edited file with repeated IDs: keep the first occurrence,
+            # tracking seen IDs by their position in the index (1 byte each)
+            seen = bytearray(len(index))
+            deduped = array("q")
+            for uid in order:
+                pos = bisect.bisect_left(index, uid)
+                if not seen[pos]:
+                    seen[pos] = 1
+                    deduped.append(uid)
+            order = deduped
+
+        with self._lock:
+            self._order = order
+            self._sorted = index
+            self._new = []
+            # A crash mid-append can leave the last line unterminated
+            self._needs_newline = bool(last_line) and not last_line.endswith(b"\n")
+            self._loaded = True
+        logger.info(f"👥 User roster loaded: {len(index)} users")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    @staticmethod
+    def _in_sorted(seq, uid: int) -> bool:
+        i = bisect.bisect_left(seq, uid)
+        return i < len(seq) and seq[i] == uid
+
+    def _known(self, uid: int) -> bool:
+        # Buffer first: a concurrent merge publishes the new index before clearing it
+        new, index = self._new, self._sorted
+        return self._in_sorted(new, uid) or self._in_sorted(index, uid)
+
+    def _merge_new(self):
+        """Fold the buffered IDs into the sorted index: one copy pass per batch"""
+        merged = array("q")
+        start = 0
+        for uid in self._new:
+            i = bisect.bisect_left(self._sorted, uid, start)
+            merged.extend(self._sorted[start:i])
+            merged.append(uid)
+            start = i
+        merged.extend(self._sorted[start:])
+        self._sorted = merged
+        self._new = []
+
+    def __contains__(self, user_id) -> bool:
+        self._ensure_loaded()
+        try:
+            return self._known(int(user_id))
+        except (TypeError, ValueError):
+            return False
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._sorted) + len(self._new)
+
+    def ids(self) -> array:
+        """Snapshot of all user IDs in join order"""
+        self._ensure_loaded()
+        with self._lock:
+            return array("q", self._order)
+
+    def add(self, user_id: int, user_name: str, username: Optional[str] = None) -> bool:
+        """Append user if unknown. Returns True when a new user was stored."""
+        self._ensure_loaded()
+        uid = int(user_id)
+        if self._known(uid):
+            return False
+
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        clean = lambda v: str(v).replace("|", " ").replace("\n", " ").replace("\r", " ")
+        entry = f"{uid}|{clean(user_name)}|{clean(username or 'N/A')}|{timestamp}\n"
+
+        with self._lock:
+            if self._known(uid):
+                return False
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self._needs_newline:
+                    f.write("\n")
+                f.write(entry)
+                f.flush()
+                os.fsync(f.fileno())
+            self._needs_newline = False
+            self._order.append(uid)
+            bisect.insort(self._new, uid)
+            if len(self._new) >= USER_INDEX_MERGE_BATCH:
+                self._merge_new()
+        return True
+
+    def profiles(self) -> List[Tuple[str, str, str, str]]:
+        """Every profile row, parsed from USERS_FILE on demand"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        return [tuple(parts) for parts in (line.split("|") for line in lines) if len(parts) == 4]
+
+    def recent(self, limit: int) -> List[Tuple[str, str, str, str]]:
+        """Last `limit` profile rows, read backwards from the end of USERS_FILE"""
+        if limit <= 0:
+            return []
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                pos = f.tell()
+                data = b""
+                while pos > 0 and data.count(b"\n") <= limit:
+                    step = min(64 * 1024, pos)
+                    pos -= step
+                    f.seek(pos)
+                    data = f.read(step) + data
+        except OSError:
+            return []
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        if pos > 0:
+            lines = lines[1:]  # first line may be cut in half
+        rows = [tuple(parts) for parts in (line.split("|") for line in lines) if len(parts) == 4]
+        return rows[-limit:]
+
+def add_user(user_id: int, user_name: str, username: Optional[str] = None):
+    """Add new user to database (a returning user who was unreachable is reachable again)"""
+    storage = get_storage()
+    if storage.add_user(user_id, user_name, username):
+        logger.info(f"✨ New user joined: {user_name} (@{username}) - ID: {user_id}")
+    elif storage.revive_user(user_id):
+        logger.info(f"🔁 User {user_id} is reachable again")
+
+def get_users() -> List[Tuple[str, str, str, str]]:
+    """Get all registered users"""
+    return get_storage().get_users()
+
+def count_users() -> int:
+    """Number of registered users"""
+    return get_storage().count_users()
+
+def get_recent_users(limit: int = 10) -> List[Tuple[str, str, str, str]]:
+    """Most recently registered users, oldest first"""
+    return get_storage().get_recent_users(limit)
+
+add_user_async = to_async(add_user)
+get_users_async = to_async(get_users)
+count_users_async = to_async(count_users)
+get_recent_users_async = to_async(get_recent_users)
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📋 GROUP/CHANNEL MANAGEMENT
+# ═══════════════════════════════════════════════════════════════════════
+
+def load_groups() -> Dict[str, str]:
+    """Load all groups/channels"""
+    storage = get_storage()
+    return dict(config_cache.get("groups", storage.load_groups, storage.groups_path))
+
+def save_groups(data: Dict[str, str]):
+    """Save groups/channels to file"""
+    get_storage().save_groups(data)
+    config_cache.invalidate("groups")
+
+def set_group(name: str, link: str):
+    """Add or update a single group/channel"""
+    get_storage().set_group(name, link)
+    config_cache.invalidate("groups")
+
+def delete_group(name: str) -> bool:
+    """Remove a single group/channel"""
+    removed = get_storage().delete_group(name)
+    config_cache.invalidate("groups")
+    return removed
+
+load_groups_async = to_async(load_groups)
+save_groups_async = to_async(save_groups)
+set_group_async = to_async(set_group)
+delete_group_async = to_async(delete_group)
+
+def channel_page_count(groups: Dict[str, str]) -> int:
+    """Number of keyboard pages needed for groups"""
+    return max(1, (len(groups) + CHANNELS_PER_PAGE - 1) // CHANNELS_PER_PAGE)
+
+def build_welcome_text(groups: Dict[str, str], page: int = 0) -> str:
+    """Welcome text shown above the channel keyboard"""
+    msg = (
+        "👋 <b>Welcome!</b>\n\n"
+        "🌟 <b>Professional Channel Manager Bot</b>\n\n"
+        "📋 <b>Available Channels</b>:\n"
+    )
+    
+    if not groups:
+        msg += "\n<i>❌ No channels available at the moment.</i>"
+    elif channel_page_count(groups) > 1:
+        msg += f"\n<i>📄 Page {page + 1}/{channel_page_count(groups)}</i>"
+    return msg
+
+def build_channels_keyboard(groups: Dict[str, str], page: int = 0) -> InlineKeyboardMarkup:
+    """
+    Build beautiful 2-column channel button grid
+    Like the image you shared - rounded URL buttons in 2 columns
+    Large channel lists are split into pages with Prev/Next buttons
+    """
+    rows = []
+    pages = channel_page_count(groups)
+    items = list(groups.items())[page * CHANNELS_PER_PAGE:(page + 1) * CHANNELS_PER_PAGE]
+    
+    # Create 2-column grid of channel buttons
+    for i in range(0, len(items), 2):
+        row = []
+        for j in range(2):
+            if i + j < len(items):
+                name, link = items[i + j]
+                row.append(InlineKeyboardButton(text=str(name), url=str(link)))
+        rows.append(row)
+    
+    # Page navigation
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"page:{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"page:{page + 1}"))
+        rows.append(nav)
+    
+    # Add action buttons below channel grid
+    refresh_data = f"refresh:{page}" if page else "refresh"
+    rows.append([InlineKeyboardButton("💸 Make Payment", callback_data="make_payment")])
+    rows.append([InlineKeyboardButton("🔄 Refresh Channels", callback_data=refresh_data)])
+    
+    return InlineKeyboardMarkup(rows)
+
+_channel_views: Dict[int, Tuple[str, InlineKeyboardMarkup]] = {}
+_channel_views_version = -1
+
+async def get_channels_view(page: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Welcome text and keyboard for a page, built once per groups version.
+    Out-of-range pages are clamped to the last page. On a miss the groups
+    are loaded off the event loop.
+    """
+    global _channel_views_version
+    version = config_cache.version("groups")
+    if version != _channel_views_version:
+        _channel_views.clear()
+        _channel_views_version = version
+
+    view = _channel_views.get(page)
+    if view is None:
+        groups = await load_groups_async()
+        page = min(max(0, page), channel_page_count(groups) - 1)
+        view = _channel_views.get(page)
+        if view is None:
+            view = (build_welcome_text(groups, page), build_channels_keyboard(groups, page))
+            # Groups edited during the load: serve the view but don't cache it
+            if config_cache.version("groups") == version:
+                _channel_views[page] = view
+    return view
+
+# (chat_id, message_id) -> (groups version, page) currently displayed
+_shown_views = LRUCache(SHOWN_VIEWS_LIMIT)
+# user_id -> monotonic time of the last handled refresh tap
+_last_refresh = LRUCache(SHOWN_VIEWS_LIMIT)
+
+def remember_shown_view(message, page: int = 0):
+    """Record which channel view a sent/edited message is showing"""
+    if message is not None and getattr(message, "chat_id", None) is not None:
+        _shown_views.set((message.chat_id, message.message_id), (config_cache.version("groups"), page))
+
+def is_view_current(message, page: int) -> bool:
+    """True when message already shows this page of the current groups"""
+    if message is None:
+        return False
+    return _shown_views.get((message.chat_id, message.message_id)) == (config_cache.version("groups"), page)
+
+def refresh_debounced(user_id: int) -> bool:
+    """True if user tapped refresh less than REFRESH_DEBOUNCE seconds ago"""
+    now = time.monotonic()
+    last = _last_refresh.get(user_id)
+    if last is not None and now - last < REFRESH_DEBOUNCE:
+        return True
+    _last_refresh.set(user_id, now)
+    return False
+
+# ═══════════════════════════════════════════════════════════════════════
+# 💰 CRYPTOMUS PAYMENT SYSTEM
+# ═══════════════════════════════════════════════════════════════════════
+
+def _load_crypto_config() -> Dict[str, Any]:
+    ensure_files()
+    return load_json(CRYPTO_CONFIG_FILE, {})
+
+def _load_payment_amount() -> int:
+    ensure_files()
+    data = load_json(PAYMENT_CONFIG_FILE, {})
+    try:
+        return int(data.get("usdt", 10))
+    except:
+        return 10
+
+def get_crypto_config():
+    """Get Cryptomus API configuration"""
+    config = config_cache.get("crypto_config", _load_crypto_config, CRYPTO_CONFIG_FILE)
+    if not config.get("api_key") or not config.get("merchant_id"):
+        return None
+    return config
+
+def get_payment_amount() -> int:
+    """Get current payment amount in USDT"""
+    return config_cache.get("payment_amount", _load_payment_amount, PAYMENT_CONFIG_FILE)
+
+def set_payment_amount_value(amount: int):
+    """Set new payment amount"""
+    save_json(PAYMENT_CONFIG_FILE, {"usdt": int(amount)})
+    config_cache.invalidate("payment_amount")
+
+class PaymentLedger:
+    """
+    In-memory payment index over the storage backend.
+    Loaded once, then kept current incrementally: uuid -> record, the
+    pending set, newest record per user, per-status counters and a
+    ring buffer of recent transactions. Writes go to storage first.
+    In multi-worker mode sync_async() merges other workers' writes.
+    """
+
+    def __init__(self):
+        self._by_uuid: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._latest_by_user: Dict[int, Dict[str, Any]] = {}
+        self._counts: Counter = Counter()
+        self._recent: deque = deque(maxlen=LEDGER_RECENT_SIZE)
+        self._loaded = False
+        self._sync_id = 0
+        self._sync_since = ""
+
+    def _index(self, record: Dict[str, Any]):
+        uuid = record.get("uuid")
+        if not uuid:
+            return
+        if uuid in self._by_uuid:
+            # Duplicate uuid (legacy data): keep the original record
+            return
+        self._by_uuid[uuid] = record
+        self._counts[record.get("status")] += 1
+        if record.get("status") == "pending":
+            self._pending[uuid] = record
+        try:
+            self._latest_by_user[int(record.get("user_id"))] = record
+        except (TypeError, ValueError):
+            pass
+        self._recent.append(record)
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        for record in get_storage().get_payments():
+            if isinstance(record, dict):
+                self._index(record)
+        self._loaded = True
+        logger.info(f"📒 Payment ledger loaded: {len(self._by_uuid)} payments")
+
+    def reload(self):
+        """Drop the in-memory index; it is rebuilt from storage on next use"""
+        self.__init__()
+
+    def all(self) -> List[Dict[str, Any]]:
+        self.ensure_loaded()
+        return list(self._by_uuid.values())
+
+    def get(self, uuid: str) -> Optional[Dict[str, Any]]:
+        self.ensure_loaded()
+        return self._by_uuid.get(uuid)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        self.ensure_loaded()
+        return list(self._pending.values())
+
+    def latest_for_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        self.ensure_loaded()
+        return self._latest_by_user.get(user_id)
+
+    def add(self, record: Dict[str, Any]):
+        self.ensure_loaded()
+        get_storage().add_payment(record)
+        self._index(record)
+
+    async def add_async(self, record: Dict[str, Any]):
+        """Like add(), with the storage write on the I/O executor"""
+        self.ensure_loaded()
+        await run_blocking(get_storage().add_payment, record)
+        self._index(record)
+
+    def _apply(self, uuid: str, new_status: str, updated_at: str) -> bool:
+        record = self._by_uuid.get(uuid)
+        if record is None:
+            return False
+        old_status = record.get("status")
+        self._counts[old_status] -= 1
+        self._counts[new_status] += 1
+        record["status"] = new_status
+        record["updated_at"] = updated_at
+        if new_status == "pending":
+            self._pending[uuid] = record
+        else:
+            self._pending.pop(uuid, None)
+        return True
+
+    def _transition_events(self, updates: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Outbox events for updates that newly mark a payment as paid"""
+        events = []
+        for uuid, new_status in updates:
+            record = self._by_uuid[uuid]
+            if new_status in PAID_STATUSES and record.get("status") not in PAID_STATUSES:
+                events.append(payment_paid_event(record))
+        return events
+
+    def update_status(self, uuid: str, new_status: str) -> bool:
+        self.ensure_loaded()
+        if uuid not in self._by_uuid:
+            return False
+        self.update_statuses([(uuid, new_status)])
+        return True
+
+    def update_statuses(self, updates: List[Tuple[str, str]]):
+        """Persist a batch of status changes (and their outbox events) in one storage write"""
+        self.ensure_loaded()
+        updates = [(uuid, status) for uuid, status in updates if uuid in self._by_uuid]
+        if not updates:
+            return
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        events = self._transition_events(updates)
+        get_storage().update_payment_statuses(updates, updated_at, events)
+        for uuid, new_status in updates:
+            self._apply(uuid, new_status, updated_at)
+        if events:
+            outbox_dispatcher.wake()
+
+    async def update_statuses_async(self, updates: List[Tuple[str, str]]):
+        """Like update_statuses(), with the storage write on the I/O executor"""
+        self.ensure_loaded()
+        updates = [(uuid, status) for uuid, status in updates if uuid in self._by_uuid]
+        if not updates:
+            return
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        events = self._transition_events(updates)
+        await run_blocking(get_storage().update_payment_statuses, updates, updated_at, events)
+        # In-memory state changes on the loop thread only
+        for uuid, new_status in updates:
+            self._apply(uuid, new_status, updated_at)
+        if events:
+            outbox_dispatcher.wake()
+
+    def _merge(self, record: Dict[str, Any]):
+        current = self._by_uuid.get(record.get("uuid"))
+        if current is None:
+            self._index(record)
+        elif current.get("status") != record.get("status"):
+            self._apply(record["uuid"], record.get("status"), record.get("updated_at"))
+
+    async def sync_async(self):
+        """Merge payments added or updated by other processes since the last sync"""
+        self.ensure_loaded()
+        since = (datetime.now() - timedelta(seconds=SHARED_SYNC_OVERLAP)).strftime("%Y-%m-%d %H:%M:%S")
+        records, max_id = await run_blocking(get_storage().get_payment_changes, self._sync_id, self._sync_since)
+        self._sync_id, self._sync_since = max_id, since
+        for record in records:
+            self._merge(record)
+
+    def stats(self) -> Dict[str, int]:
+        self.ensure_loaded()
+        return {
+            "total": len(self._by_uuid),
+            "paid": self._counts["paid"],
+            "pending": self._counts["pending"],
+            "failed": self._counts["failed"],
+        }
+
+    def recent(self, limit: int = 5) -> List[Dict[str, Any]]:
+        self.ensure_loaded()
+        return [self._recent[-i] for i in range(1, min(limit, len(self._recent)) + 1)]
+
+payment_ledger = PaymentLedger()
+
+def get_payments() -> List[Dict[str, Any]]:
+    """Get all payment records"""
+    return payment_ledger.all()
+
+def add_payment(user_id: int, username: str, amount: int, uuid: str, status: str, url: str, date: str):
+    """Add new payment record"""
+    payment_ledger.add({
+        "user_id": user_id,
+        "username": username,
+        "amount": amount,
+        "uuid": uuid,
+        "status": status,
+        "url": url,
+        "date": date,
+    })
+
+def update_payment_status(uuid: str, new_status: str) -> bool:
+    """Update payment status"""
+    return payment_ledger.update_status(uuid, new_status)
+
+# Ledger writes keep in-memory state on the loop thread; only storage I/O is offloaded
+async def add_payment_async(user_id: int, username: str, amount: int, uuid: str, status: str, url: str, date: str):
+    await payment_ledger.add_async({
+        "user_id": user_id,
+        "username": username,
+        "amount": amount,
+        "uuid": uuid,
+        "status": status,
+        "url": url,
+        "date": date,
+    })
+
+async def update_payment_status_async(uuid: str, new_status: str) -> bool:
+    if payment_ledger.get(uuid) is None:
+        return False
+    await payment_ledger.update_statuses_async([(uuid, new_status)])
+    return True
+
+get_payments_async = to_async(get_payments)
+get_crypto_config_async = to_async(get_crypto_config)
+get_payment_amount_async = to_async(get_payment_amount)
+set_payment_amount_value_async = to_async(set_payment_amount_value)
+
+class CryptomusError(Exception):
+    """Retryable Cryptomus API failure (5xx / rate limit)"""
+
+class CryptomusClient:
+    """
+    Native asyncio Cryptomus client.
+    A single httpx.AsyncClient is shared so connections are kept alive
+    between calls. Network errors and 5xx/429 responses are retried a
+    bounded number of times with jittered exponential backoff.
+    """
+
+    def __init__(self, base_url: str = CRYPTOMUS_API_URL, max_retries: int = CRYPTOMUS_MAX_RETRIES):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(CRYPTOMUS_INFO_TIMEOUT, connect=10),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+            )
+        return self._client
+
+    @staticmethod
+    def _headers(config: Dict[str, Any], body: bytes) -> Dict[str, str]:
+        return {
+            "merchant": config["merchant_id"],
+            "sign": cryptomus_sign_body(body, config["api_key"]),
+            "Content-Type": "application/json",
+        }
+
+    async def _post(self, path: str, payload: Dict[str, Any], config: Dict[str, Any], timeout: float,
+                    deadline: Optional[float] = None) -> Any:
+        """POST with retries; `deadline` caps the total seconds spent on all attempts"""
+        give_up_at = time.monotonic() + deadline if deadline else None
+        # Serialized once: the signature covers these exact bytes
+        body = cryptomus_json(payload)
+        for attempt in range(self.max_retries + 1):
+            attempt_timeout = timeout
+            if give_up_at is not None:
+                attempt_timeout = min(timeout, give_up_at - time.monotonic())
+                if attempt_timeout <= 0:
+                    raise CryptomusError(f"{path} deadline of {deadline}s exceeded")
+            try:
+                started = time.perf_counter()
+                resp = await self._http().post(
+                    path, content=body, headers=self._headers(config, body), timeout=attempt_timeout
+                )
+                metrics.observe("cryptomus_request_duration_seconds", time.perf_counter() - started,
+                                endpoint=path, code=str(resp.status_code))
+                if resp.status_code >= 500 or resp.status_code == 429:
+                    raise CryptomusError(f"HTTP {resp.status_code}")
+                return resp.json()
+            except (httpx.TransportError, CryptomusError) as ex:
+                metrics.inc("cryptomus_request_failures_total", endpoint=path)
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if give_up_at is not None and time.monotonic() + delay >= give_up_at:
+                    raise
+                logger.warning(f"⚠️ Cryptomus {path} failed ({ex}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def create_payment(self, config: Dict[str, Any], amount: int, order_id: str) -> Any:
+        # Retries reuse the same order_id, so Cryptomus never bills twice
+        payload = {
+            "amount": str(amount),
+            "currency": "USDT",
+            "order_id": order_id,
+            "network": "tron",
+        }
+        if config.get("webhook_url"):
+            payload["url_callback"] = config["webhook_url"]
+        return await self._post("/payment", payload, config, CRYPTOMUS_CREATE_TIMEOUT, CRYPTOMUS_CREATE_DEADLINE)
+
+    async def payment_info(self, config: Dict[str, Any], uuid: str) -> Any:
+        return await self._post("/payment/info", {"uuid": uuid}, config, CRYPTOMUS_INFO_TIMEOUT)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+cryptomus = CryptomusClient()
+
+async def get_invoice_status(uuid: str) -> str:
+    """Check invoice status from Cryptomus API"""
+    config = get_crypto_config()
+    if not config:
+        return "unknown"
+    
+    try:
+        with metrics.timer("bot_get_invoice_status_seconds"):
+            data = await cryptomus.payment_info(config, uuid)
+        if isinstance(data, dict) and "result" in data:
+            return data["result"].get("payment_status", "unknown")
+        return data.get("payment_status", "unknown")
+    except Exception as ex:
+        logger.error(f"❌ Error checking invoice status: {ex}")
+        return "unknown"
+
+def payment_timestamp(record: Dict[str, Any]) -> float:
+    """Creation time of a payment record as a UNIX timestamp"""
+    try:
+        return datetime.strptime(record.get("date", ""), "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+class PaymentPoller:
+    """
+    Asyncio payment status scheduler.
+    Pending invoices sit in a min-heap keyed by their next check time.
+    Due invoices are checked concurrently (bounded by POLL_CONCURRENCY);
+    the check interval doubles as an invoice ages, and invoices past
+    INVOICE_LIFETIME are expired. All status changes found in one cycle
+    are written in a single batch.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._scheduled: Dict[str, float] = {}
+        self._created: Dict[str, float] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.base_interval = POLL_INTERVAL
+
+    def _schedule(self, uuid: str, when: float):
+        self._scheduled[uuid] = when
+        heapq.heappush(self._heap, (when, uuid))
+
+    def _next_interval(self, uuid: str, now: float) -> float:
+        age = max(0.0, now - self._created.get(uuid, now))
+        return min(max(POLL_MAX_INTERVAL, self.base_interval),
+                   self.base_interval * 2 ** int(age // POLL_BACKOFF_AGE))
+
+    def refresh(self):
+        """Pick up new pending invoices and drop ones settled elsewhere"""
+        pending = {p["uuid"]: p for p in payment_ledger.pending()}
+        now = time.time()
+        # In reconciliation mode the webhook is expected to settle new invoices first
+        first_check = now if self.base_interval <= POLL_INTERVAL else now + self.base_interval
+        for uuid, record in pending.items():
+            if uuid not in self._scheduled:
+                self._created[uuid] = payment_timestamp(record)
+                self._schedule(uuid, first_check)
+        for uuid in list(self._scheduled):
+            if uuid not in pending:
+                self._scheduled.pop(uuid, None)
+                self._created.pop(uuid, None)
+
+    def _pop_due(self, now: float) -> List[str]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, uuid = heapq.heappop(self._heap)
+            # Skip heap entries superseded by a reschedule or removal
+            if self._scheduled.get(uuid) == when:
+                due.append(uuid)
+        return due
+
+    async def _check(self, uuid: str) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(POLL_CONCURRENCY)
+        async with self._semaphore:
+            return await get_invoice_status(uuid)
+
+    async def run_cycle(self) -> List[Tuple[str, str]]:
+        """Check every due invoice once and persist the changes in one batch"""
+        with metrics.timer("bot_poll_cycle_duration_seconds"):
+            return await self._run_cycle()
+
+    async def _run_cycle(self) -> List[Tuple[str, str]]:
+        self.refresh()
+        now = time.time()
+        due = self._pop_due(now)
+        if not due:
+            return []
+
+        statuses = await asyncio.gather(*(self._check(uuid) for uuid in due))
+        metrics.inc("bot_poll_checks_total", len(due))
+        now = time.time()
+        changes = []
+        for uuid, new_status in zip(due, statuses):
+            expired = now - self._created.get(uuid, now) > INVOICE_LIFETIME
+            if new_status and new_status not in ("pending", "unknown"):
+                changes.append((uuid, new_status))
+            elif expired:
+                changes.append((uuid, "expired"))
+            else:
+                self._schedule(uuid, now + self._next_interval(uuid, now))
+                continue
+            self._scheduled.pop(uuid, None)
+            self._created.pop(uuid, None)
+
+        if changes:
+            await payment_ledger.update_statuses_async(changes)
+            for uuid, new_status in changes:
+                logger.info(f"💰 Payment {uuid} updated: {new_status}")
+        return changes
+
+    async def run(self):
+        while True:
+            try:
+                if get_crypto_config():
+                    await self.run_cycle()
+            except Exception as e:
+                logger.error(f"❌ Payment polling error: {e}")
+
+            # Wake for the next due invoice, but re-scan for new ones at least every POLL_INTERVAL
+            delay = min(POLL_INTERVAL, self.base_interval)
+            if self._heap:
+                delay = min(delay, max(1.0, self._heap[0][0] - time.time()))
+            await asyncio.sleep(delay)
+
+payment_poller = PaymentPoller()
+
+async def poll_payments():
+    """Background task that keeps pending payment statuses up to date"""
+    await payment_poller.run()
+
+def cryptomus_json(data: Dict[str, Any]) -> bytes:
+    """PHP json_encode($data, JSON_UNESCAPED_UNICODE) output, the form Cryptomus signs"""
+    # PHP escapes forward slashes; unicode stays as-is
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).replace("/", "\\/").encode("utf-8")
+
+def cryptomus_sign_body(body: bytes, api_key: str) -> str:
+    """Cryptomus signature of a JSON body: md5(base64(body) + api_key)"""
+    return hashlib.md5(base64.b64encode(body) + api_key.encode("utf-8")).hexdigest()
+
+def cryptomus_sign(data: Dict[str, Any], api_key: str) -> str:
+    """Signature of a webhook payload: computed over the payload without its "sign" field"""
+    return cryptomus_sign_body(cryptomus_json({k: v for k, v in data.items() if k != "sign"}), api_key)
+
+# A callback body exactly as Cryptomus (PHP json_encode with JSON_UNESCAPED_UNICODE)
+# delivers it: slashes escaped as \/, Cyrillic and emoji left raw. The sign was
+# computed independently as md5(base64(body_without_sign) + key).
+CRYPTOMUS_SAMPLE_KEY = "uQ4LFVvO9X5Sj1pKH2xkN0l7Mt3bRzYc"
+CRYPTOMUS_SAMPLE_CALLBACK = (
+    r'{"type":"payment","uuid":"62f88b36-a9d5-4fa6-aa26-e040c3dbf26d",'
+    r'"order_id":"97a75bf8eda5cca41ba9d2e104840fcd","amount":"3.00000000",'
+    r'"payment_amount":"3.00000000","payment_amount_usd":"0.23","merchant_amount":"2.94000000",'
+    r'"commission":"0.06000000","is_final":true,"status":"paid",'
+    r'"from":"THgEWubVc8tPKXLJ4VZ5zbiiAK7AgqSeGH","wallet_address_uuid":null,"network":"tron",'
+    r'"currency":"TRX","payer_currency":"TRX",'
+    r'"additional_data":"Подписка ✅ https:\/\/t.me\/example_bot",'
+    r'"convert":{"to_currency":"USDT","commission":null,"rate":"0.07700000","amount":"0.22638000"},'
+    r'"txid":"6f0d9c8374db57cac0d806251473de754f361c83a03cd805f74aa9da3193486b",'
+    r'"sign":"7be234720c0088c23498ed31fcbba2db"}'
+)
+
+def check_cryptomus_signing() -> bool:
+    """Known-answer check: our encoder must reproduce the sample's Cryptomus signature"""
+    data = json.loads(CRYPTOMUS_SAMPLE_CALLBACK)
+    return hmac.compare_digest(data["sign"], cryptomus_sign(data, CRYPTOMUS_SAMPLE_KEY))
+
+async def handle_cryptomus_webhook(body: bytes, headers: Dict[str, str]):
+    """Verify a Cryptomus payment callback and apply it immediately"""
+    config = get_crypto_config()
+    if not config:
+        return 503, "text/plain", b"not configured"
+    try:
+        data = json.loads(body.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return 400, "text/plain", b"bad json"
+    if not isinstance(data, dict):
+        return 400, "text/plain", b"bad json"
+
+    sign = str(data.get("sign", ""))
+    if not sign or not hmac.compare_digest(sign, cryptomus_sign(data, config["api_key"])):
+        logger.warning("⚠️ Rejected Cryptomus webhook with invalid signature")
+        return 401, "text/plain", b"bad sign"
+
+    uuid = data.get("uuid")
+    new_status = data.get("status") or data.get("payment_status")
+    if uuid and new_status and new_status not in ("pending", "unknown"):
+        if await update_payment_status_async(uuid, new_status):
+            logger.info(f"💰 Payment {uuid} updated via webhook: {new_status}")
+    return 200, "application/json", b'{"ok":true}'
+
+_webhook_server: Optional[MiniHTTPServer] = None
+
+async def start_cryptomus_webhook():
+    """Start the callback endpoint if configured and slow the poller down to a sweep"""
+    global _webhook_server
+    config = get_crypto_config() or {}
+    port = config.get("webhook_port")
+    if not port:
+        return
+    if not check_cryptomus_signing():
+        logger.error("❌ Cryptomus signature self-check failed, webhook disabled; polling stays active")
+        return
+    server = MiniHTTPServer(config.get("webhook_listen", "0.0.0.0"), int(port))
+    server.route("POST", config.get("webhook_path", CRYPTOMUS_WEBHOOK_PATH), handle_cryptomus_webhook)
+    await server.start()
+    _webhook_server = server
+    payment_poller.base_interval = POLL_RECONCILE_INTERVAL
+    logger.info(f"💳 Cryptomus webhook active, polling reduced to {POLL_RECONCILE_INTERVAL}s sweeps")
+
+async def stop_cryptomus_webhook():
+    global _webhook_server
+    if _webhook_server is not None:
+        await _webhook_server.stop()
+        _webhook_server = None
+
+def send_test_webhook(uuid: str, status: str = "paid", url: Optional[str] = None) -> int:
+    """
+    Local stand-in for Cryptomus: POST a signed sample callback to the
+    configured endpoint and return the HTTP status code.
+    """
+    if not check_cryptomus_signing():
+        raise SystemExit("❌ Signature self-check failed: the sample Cryptomus callback does not verify")
+    config = get_crypto_config()
+    if not config:
+        raise SystemExit("❌ cryptomus_config.json is not configured")
+    if url is None:
+        url = (f"http://127.0.0.1:{config.get('webhook_port', 8081)}"
+               f"{config.get('webhook_path', CRYPTOMUS_WEBHOOK_PATH)}")
+    data = {
+        "type": "payment",
+        "uuid": uuid,
+        "order_id": f"test_{int(time.time())}",
+        "amount": str(get_payment_amount()),
+        "payment_amount": str(get_payment_amount()),
+        "merchant_amount": str(get_payment_amount()),
+        "network": "tron",
+        "currency": "USDT",
+        "payer_currency": "USDT",
+        "is_final": True,
+        "status": status,
+    }
+    data["sign"] = cryptomus_sign(data, config["api_key"])
+    # Send PHP-style bytes like Cryptomus does, not Python's default encoding
+    resp = httpx.post(url, content=cryptomus_json(data),
+                      headers={"Content-Type": "application/json"}, timeout=10)
+    print(f"📨 Sent test webhook for {uuid} ({status}): HTTP {resp.status_code}")
+    return resp.status_code
+
+async def create_invoice(user_id: int, username: str, amount: Optional[int] = None):
+    """Create new Cryptomus invoice"""
+    config = get_crypto_config()
+    if not config:
+        return None, None
+    
+    if amount is None:
+        amount = get_payment_amount()
+    order_id = f"{user_id}_{int(time.time())}"
+    
+    try:
+        with metrics.timer("bot_create_invoice_seconds"):
+            data = await cryptomus.create_payment(config, amount, order_id)
+        result = data.get("result", {}) if isinstance(data, dict) else {}
+        
+        uuid = result.get("uuid")
+        url = result.get("url")
+        
+        if uuid and url:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            await add_payment_async(user_id, username, amount, uuid, "pending", url, now)
+            logger.info(f"💸 Invoice created for {username}: {amount} USDT")
+            return url, uuid
+        
+        logger.error(f"❌ Invoice creation failed: {data}")
+        return None, None
+    except Exception as ex:
+        logger.error(f"❌ Error creating invoice: {ex}")
+        return None, None
+
+class InvoiceManager:
+    """
+    Idempotent invoice creation for "Make Payment".
+    An unexpired pending invoice for the current amount (looked up in the
+    ledger's per-user index) is returned as-is, and concurrent taps from
+    one user share a single in-flight API call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[int, "asyncio.Task"] = {}
+
+    def pending_for(self, user_id: int, amount: int) -> Optional[Dict[str, Any]]:
+        """Reusable pending invoice for user and amount, if any"""
+        p = payment_ledger.latest_for_user(user_id)
+        if not p or p.get("status") != "pending" or p.get("amount") != amount:
+            return None
+        if time.time() - payment_timestamp(p) > INVOICE_REUSE_WINDOW:
+            return None
+        return p
+
+    async def get_or_create(self, user_id: int, username: str, amount: int):
+        """Return (url, uuid) of a reusable or newly created invoice"""
+        existing = self.pending_for(user_id, amount)
+        if existing:
+            logger.info(f"♻️ Reusing pending invoice {existing['uuid']} for {username}")
+            return existing["url"], existing["uuid"]
+
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(create_invoice(user_id, username, amount))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda _t, uid=user_id: self._inflight.pop(uid, None))
+        # shield: one cancelled waiter must not cancel the shared call
+        return await asyncio.shield(task)
+
+invoice_manager = InvoiceManager()
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📢 BROADCAST ENGINE
+# ═══════════════════════════════════════════════════════════════════════
+
+class RateLimiter:
+    """
+    Async token bucket shared by all broadcast senders.
+    RetryAfter pauses every sender and lowers the rate; it creeps back
+    up towards the configured rate after a run of successful sends.
+    """
+
+    def __init__(self, rate: float):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._successes = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def backoff(self, retry_after: float):
+        """Pause all senders and slow down after a flood-wait"""
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self.rate = max(1.0, self.rate * 0.7)
+        self.tokens = 0
+        self._successes = 0
+        logger.warning(f"⏳ Flood control: pausing {retry_after}s, rate now {self.rate:.1f}/s")
+
+    def success(self):
+        self._successes += 1
+        if self.rate < self.max_rate and self._successes >= 100:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+            self._successes = 0
+
+# Media kinds a broadcast can carry, with their Bot API send method
+BROADCAST_MEDIA_SENDERS = {
+    "photo": "send_photo",
+    "video": "send_video",
+    "animation": "send_animation",
+    "document": "send_document",
+    "audio": "send_audio",
+    "voice": "send_voice",
+}
+ALBUM_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+def broadcast_item(message) -> Optional[Dict[str, Any]]:
+    """
+    What to send for one admin message: its HTML text, or its media's
+    file_id and caption. Media is already on Telegram's servers, so the
+    file_id is all a recipient needs. None if the kind is unsupported.
+    """
+    if message.text:
+        return {"type": "text", "text": message.text_html}
+    # animation before document: GIF messages carry both
+    for kind in BROADCAST_MEDIA_SENDERS:
+        media = getattr(message, kind, None)
+        if not media:
+            continue
+        if kind == "photo":
+            media = media[-1]
+        return {
+            "type": kind,
+            "file_id": media.file_id,
+            "file_unique_id": media.file_unique_id,
+            "caption": message.caption_html if message.caption else None,
+        }
+    return None
+
+class MediaCache:
+    """
+    file_ids of broadcast media (keyed by file_unique_id) plus the last
+    campaign's content, stored in MEDIA_CACHE_FILE. Lets a campaign be
+    repeated after a restart without anything being uploaded again,
+    even once the admin's original message is gone.
+    """
+
+    def __init__(self, path: str = MEDIA_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Any]:
+        data = load_json(self.path, {}) if os.path.isfile(self.path) else {}
+        data.setdefault("files", {})
+        return data
+
+    def remember(self, content: Dict[str, Any]):
+        """Cache the content's file_ids and make it the last campaign"""
+        with self._lock:
+            data = self._load()
+            files = data["files"]
+            for item in content_items(content):
+                if item.get("file_unique_id"):
+                    files.pop(item["file_unique_id"], None)
+                    files[item["file_unique_id"]] = {"type": item["type"], "file_id": item["file_id"]}
+            for key in list(files)[:max(0, len(files) - MEDIA_CACHE_SIZE)]:
+                del files[key]
+            data["last"] = content
+            save_json(self.path, data, backup=False)
+
+    def last(self) -> Optional[Dict[str, Any]]:
+        return self._load().get("last")
+
+    def resolve(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """item with the cached file_id for its media, if any"""
+        return self.resolve_all([item])[0]
+
+    def resolve_all(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        files = self._load()["files"]
+        resolved = []
+        for item in items:
+            cached = files.get(item.get("file_unique_id") or "")
+            resolved.append(dict(item, file_id=cached["file_id"]) if cached else item)
+        return resolved
+
+media_cache = MediaCache()
+
+def content_items(content: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The single items (text or media) that make up broadcast content"""
+    if content["type"] == "album":
+        return content["items"]
+    if content["type"] == "copy":
+        return [content["message"]]
+    return [content]
+
+def content_label(content: Dict[str, Any]) -> str:
+    if content["type"] == "album":
+        return f"album of {len(content['items'])}"
+    return content_items(content)[0]["type"]
+
+async def send_broadcast_item(bot, chat_id: int, item: Dict[str, Any]):
+    """Send one text/media item by file_id (no bytes are uploaded)"""
+    if item["type"] == "text":
+        await bot.send_message(chat_id=chat_id, text=item["text"], parse_mode=ParseMode.HTML)
+        return
+    send = getattr(bot, BROADCAST_MEDIA_SENDERS[item["type"]])
+    await send(chat_id, item["file_id"], caption=item.get("caption"), parse_mode=ParseMode.HTML)
+
+# Broadcast results that tell us something about the recipient
+REACHABILITY_BY_RESULT = {"sent": "reachable", "blocked": "dead"}
+
+def is_unreachable_error(error: Exception) -> bool:
+    """True if the user blocked the bot or their account/chat no longer exists"""
+    if isinstance(error, Forbidden):
+        return True
+    message = str(error).lower()
+    return isinstance(error, BadRequest) and ("chat not found" in message or "user is deactivated" in message)
+
+def sorted_contains(values: array, value: int) -> bool:
+    i = bisect.bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+class BroadcastJob:
+    """
+    Background broadcast with checkpointing.
+    Users are processed in chunks; after each chunk the offset and
+    counters are written to BROADCAST_STATE_FILE so a restart resumes
+    from the last finished chunk. The runner holds the "broadcast" lease,
+    so only one worker process sends at a time.
+    """
+
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+        # Checkpoints from before media support carry plain "text"
+        self.content = state.get("content") or {"type": "text", "text": safe_html(state.get("text", ""))}
+        self._album: Optional[List[Any]] = None
+        self._fallback: Optional[Dict[str, Any]] = None
+        self._source_gone = False
+        self.limiter = RateLimiter(BROADCAST_RATE)
+        self.semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        self._chat_last_sent: Dict[int, float] = {}
+        self._last_progress = 0.0
+        self._lease_lost = False
+
+    @classmethod
+    def new(cls, content: Dict[str, Any], admin_chat_id: int) -> "BroadcastJob":
+        """
+        content is a text/media item, {"type": "copy", "from_chat_id",
+        "message_id", "message": item} to fan out the admin's own message
+        with copy_message, or {"type": "album", "items": [...]}.
+        """
+        return cls({
+            "job_id": f"bc_{int(time.time())}",
+            "content": content,
+            "admin_chat_id": admin_chat_id,
+            "status_message_id": None,
+            "offset": 0,
+            "total": 0,
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+
+    @classmethod
+    def load(cls) -> Optional["BroadcastJob"]:
+        if not os.path.isfile(BROADCAST_STATE_FILE):
+            return None
+        state = load_json(BROADCAST_STATE_FILE, {})
+        if not state.get("job_id"):
+            return None
+        return cls(state)
+
+    def checkpoint(self):
+        save_json(BROADCAST_STATE_FILE, self.state, backup=False)
+
+    def clear(self):
+        try:
+            os.remove(BROADCAST_STATE_FILE)
+        except FileNotFoundError:
+            pass
+
+    def progress_text(self, done: bool = False) -> str:
+        s = self.state
+        title = "✅ <b>Broadcast Complete!</b>" if done else "📢 <b>Broadcasting...</b>"
+        return (
+            f"{title}\n\n"
+            f"👥 Progress: {s['offset']}/{s['total']}\n"
+            f"📤 Sent: {s['sent']}\n"
+            f"🚫 Blocked/deleted: {s['blocked']}\n"
+            f"💤 Skipped (unreachable): {s.get('skipped', 0)}\n"
+            f"❌ Failed: {s['failed']}"
+        )
+
+    def _resolve_media(self):
+        """Look up cached file_ids once, before sending (reads MEDIA_CACHE_FILE)"""
+        content = self.content
+        if content["type"] == "album":
+            self._album = [
+                ALBUM_MEDIA_TYPES[i["type"]](media=i["file_id"], caption=i.get("caption"), parse_mode=ParseMode.HTML)
+                for i in media_cache.resolve_all(content["items"])
+            ]
+        elif content["type"] == "copy":
+            self._fallback = media_cache.resolve(content["message"])
+
+    async def _deliver(self, bot, chat_id: int):
+        content = self.content
+        if content["type"] == "album":
+            await bot.send_media_group(chat_id=chat_id, media=self._album)
+        elif content["type"] == "copy":
+            if not self._source_gone:
+                try:
+                    await bot.copy_message(
+                        chat_id=chat_id,
+                        from_chat_id=content["from_chat_id"],
+                        message_id=content["message_id"],
+                    )
+                    return
+                except BadRequest as e:
+                    # Anything else (e.g. "chat not found") is about the recipient; _send_one classifies it
+                    if "message to copy not found" not in str(e).lower():
+                        raise
+                    # The admin deleted the original; send the cached file_id instead
+                    if not self._source_gone:
+                        logger.warning("⚠️ Broadcast source message is gone, sending by file_id")
+                        self._source_gone = True
+                        content["message"] = self._fallback
+            await send_broadcast_item(bot, chat_id, content["message"])
+        else:
+            await send_broadcast_item(bot, chat_id, content)
+
+    async def _send_one(self, bot, chat_id: int) -> str:
+        """Deliver to one chat. Returns 'sent', 'blocked' (user unreachable) or 'failed'."""
+        async with self.semaphore:
+            for attempt in range(3):
+                wait = self._chat_last_sent.get(chat_id, 0) + BROADCAST_PER_CHAT_INTERVAL - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self.limiter.acquire()
+                self._chat_last_sent[chat_id] = time.monotonic()
+                try:
+                    await self._deliver(bot, chat_id)
+                    self.limiter.success()
+                    return "sent"
+                except RetryAfter as e:
+                    self.limiter.backoff(float(e.retry_after))
+                except (Forbidden, BadRequest) as e:
+                    # BadRequest is a NetworkError subclass; retrying it never helps
+                    if is_unreachable_error(e):
+                        return "blocked"
+                    logger.debug(f"Broadcast to {chat_id} failed: {e}")
+                    return "failed"
+                except (TimedOut, NetworkError):
+                    await asyncio.sleep(1 + attempt)
+                except Exception as e:
+                    logger.debug(f"Broadcast to {chat_id} failed: {e}")
+                    return "failed"
+            return "failed"
+
+    async def _report_progress(self, bot, done: bool = False):
+        now = time.monotonic()
+        if not done and now - self._last_progress < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        s = self.state
+        try:
+            if s.get("status_message_id") and not done:
+                await bot.edit_message_text(
+                    chat_id=s["admin_chat_id"],
+                    message_id=s["status_message_id"],
+                    text=self.progress_text(),
+                    parse_mode=ParseMode.HTML,
+                )
+            else:
+                msg = await bot.send_message(
+                    chat_id=s["admin_chat_id"],
+                    text=self.progress_text(done),
+                    parse_mode=ParseMode.HTML,
+                )
+                s["status_message_id"] = msg.message_id
+        except Exception as e:
+            logger.debug(f"Broadcast progress update failed: {e}")
+
+    async def _hold_lease(self):
+        """Renew the broadcast lease; stop the job if another worker took it over"""
+        while True:
+            await asyncio.sleep(BROADCAST_LEASE_TTL / 3)
+            try:
+                if not await run_blocking(get_storage().acquire_lease, "broadcast", WORKER_ID, BROADCAST_LEASE_TTL):
+                    logger.warning(f"⚠️ Broadcast {self.state['job_id']} lease lost, stopping")
+                    self._lease_lost = True
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ Broadcast lease renewal failed: {e}")
+
+    async def run(self, bot):
+        global _active_broadcast
+        s = self.state
+        heartbeat = asyncio.ensure_future(self._hold_lease())
+        try:
+            # array('q') snapshot: 8 bytes per recipient, no per-user objects
+            user_ids = await run_blocking(get_storage().get_user_ids)
+            dead = await run_blocking(get_storage().get_dead_user_ids)
+            await run_blocking(self._resolve_media)
+            s["total"] = len(user_ids)
+            s.setdefault("skipped", 0)
+            logger.info(f"📢 Broadcast {s['job_id']} running from {s['offset']}/{s['total']}")
+            await self._report_progress(bot)
+
+            while s["offset"] < len(user_ids):
+                if self._lease_lost:
+                    return
+                chunk = user_ids[s["offset"]:s["offset"] + BROADCAST_CHUNK]
+                # Offsets index the full roster, so dead users are skipped here, not filtered out
+                targets = [uid for uid in chunk if not sorted_contains(dead, uid)]
+                results = await asyncio.gather(*(self._send_one(bot, uid) for uid in targets))
+                for r in results:
+                    s[r] += 1
+                    metrics.inc("bot_broadcast_messages_total", result=r)
+                if len(targets) < len(chunk):
+                    s["skipped"] += len(chunk) - len(targets)
+                    metrics.inc("bot_broadcast_messages_total", len(chunk) - len(targets), result="skipped")
+                outcomes = [(uid, REACHABILITY_BY_RESULT[r]) for uid, r in zip(targets, results) if r in REACHABILITY_BY_RESULT]
+                await run_blocking(get_storage().record_reachability, outcomes, time.time())
+                s["offset"] += len(chunk)
+                # Per-chat spacing only matters for retries within a chunk
+                self._chat_last_sent.clear()
+                await run_blocking(self.checkpoint)
+                await self._report_progress(bot)
+
+            await self._report_progress(bot, done=True)
+            logger.info(
+                f"📢 Broadcast {s['job_id']} done: sent={s['sent']} "
+                f"blocked={s['blocked']} skipped={s['skipped']} failed={s['failed']}"
+            )
+            await run_blocking(self.clear)
+        except asyncio.CancelledError:
+            self.checkpoint()
+            raise
+        finally:
+            heartbeat.cancel()
+            _active_broadcast = None
+            if not self._lease_lost:
+                try:
+                    get_storage().release_lease("broadcast", WORKER_ID)
+                except Exception as e:
+                    logger.warning(f"⚠️ Broadcast lease release failed: {e}")
+
+_active_broadcast: Optional[BroadcastJob] = None
+
+async def start_broadcast_job(application, job: BroadcastJob) -> bool:
+    """Run job in the background unless another broadcast is active (in any worker)"""
+    global _active_broadcast
+    if _active_broadcast is not None:
+        return False
+    _active_broadcast = job
+    try:
+        acquired = await run_blocking(get_storage().acquire_lease, "broadcast", WORKER_ID, BROADCAST_LEASE_TTL)
+    except Exception as e:
+        logger.error(f"❌ Broadcast lease error: {e}")
+        acquired = False
+    if not acquired:
+        _active_broadcast = None
+        return False
+    await run_blocking(job.checkpoint)
+    application.create_task(job.run(application.bot))
+    return True
+
+async def resume_broadcast(application):
+    """Resume an interrupted broadcast from its checkpoint"""
+    if _active_broadcast is not None:
+        return
+    job = await run_blocking(BroadcastJob.load)
+    if job and await start_broadcast_job(application, job):
+        logger.info(f"📢 Resumed broadcast {job.state['job_id']}")
+
+class ReachabilityProber:
+    """
+    Low-priority re-check of dead recipients, so users who unblock the bot
+    get broadcasts again. Every REPROBE_INTERVAL it sends a "typing" chat
+    action (nothing lands in the chat) to dead users last tried more than
+    REPROBE_AFTER ago, at REPROBE_RATE, and pauses while a broadcast runs.
+    """
+
+    def __init__(self):
+        self._limiter: Optional[RateLimiter] = None
+
+    async def probe_once(self, bot) -> int:
+        """Probe one batch; returns how many users became reachable again"""
+        if self._limiter is None:
+            self._limiter = RateLimiter(REPROBE_RATE)
+        storage = get_storage()
+        candidates = await run_blocking(storage.get_reprobe_candidates, time.time() - REPROBE_AFTER, REPROBE_BATCH)
+        outcomes: List[Tuple[int, str]] = []
+        for user_id in candidates:
+            if _active_broadcast is not None:
+                break
+            await self._limiter.acquire()
+            try:
+                await bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
+                outcomes.append((user_id, "reachable"))
+            except RetryAfter as e:
+                self._limiter.backoff(float(e.retry_after))
+            except Exception as e:
+                if is_unreachable_error(e):
+                    outcomes.append((user_id, "dead"))
+                else:
+                    logger.debug(f"Re-probe of {user_id} failed: {e}")
+        await run_blocking(storage.record_reachability, outcomes, time.time())
+        revived = sum(1 for _, state in outcomes if state == "reachable")
+        for _, state in outcomes:
+            metrics.inc("bot_reprobe_total", result=state)
+        if revived:
+            logger.info(f"🔁 Re-probe: {revived}/{len(outcomes)} dead users are reachable again")
+        return revived
+
+    async def run(self, bot):
+        while True:
+            await asyncio.sleep(REPROBE_INTERVAL)
+            try:
+                await self.probe_once(bot)
+            except Exception as e:
+                logger.error(f"❌ Re-probe error: {e}")
+
+reachability_prober = ReachabilityProber()
+
+# ═══════════════════════════════════════════════════════════════════════
+# 📬 NOTIFICATION OUTBOX
+# ═══════════════════════════════════════════════════════════════════════
 
-def update_payment_status(uuid: str, new_status: str):
-    """Update payment status"""
-    payments = get_payments()
-    for p in payments:
-        if p.get("uuid") == uuid:
-            p["status"] = new_status
-            p["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    save_payments(payments)
-
-def get_invoice_status(uuid: str) -> str:
-    """Check invoice status from Cryptomus API"""
-    config = get_crypto_config()
-    if not config:
-        return "unknown"
-    
-    url = "https://api.cryptomus.com/v1/payment/info"
-    payload = {"uuid": uuid}
-    headers = {
-        "merchant": config["merchant_id"],
-        "sign": "",
-        "Content-Type": "application/json",
-        "Authorization": config["api_key"],
+def payment_paid_event(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Outbox event telling the payer their invoice was paid (one per invoice)"""
+    return {
+        "event_key": f"payment_paid:{record['uuid']}",
+        "kind": "payment_paid",
+        "chat_id": int(record["user_id"]),
+        "payload": {"uuid": record["uuid"], "amount": record.get("amount")},
     }
-    
-    try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=15)
-        data = resp.json()
-        if isinstance(data, dict) and "result" in data:
-            return data["result"].get("payment_status", "unknown")
-        return data.get("payment_status", "unknown")
-    except Exception as ex:
-        logger.error(f"❌ Error checking invoice status: {ex}")
-        return "unknown"
 
-def poll_payments():
-    """Background thread to poll payment statuses every 30s"""
-    while True:
+def render_event(event: Dict[str, Any]) -> str:
+    payload = event["payload"]
+    if event["kind"] == "payment_paid":
+        return (
+            "✅ <b>Payment Received!</b>\n\n"
+            f"💰 Amount: <b>{safe_html(str(payload.get('amount')))} USDT</b>\n"
+            f"🧾 Invoice: <code>{safe_html(str(payload.get('uuid')))}</code>\n\n"
+            "Thank you for your payment! 🙏"
+        )
+    raise ValueError(f"unknown event kind {event['kind']}")
+
+class OutboxDispatcher:
+    """
+    Delivers outbox events in rate-limited batches, independent of the
+    code that enqueued them. Events are stored in the same write as the
+    status change that caused them and only marked sent after Telegram
+    accepted the message, so a confirmation survives restarts; the
+    event_key makes enqueueing idempotent. Transient failures retry with
+    exponential backoff; blocked users and bad requests fail for good.
+    """
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        self._limiter: Optional[RateLimiter] = None
+
+    def wake(self):
+        """New events were enqueued; dispatch without waiting for the idle interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @staticmethod
+    def _retry_delay(attempts: int) -> float:
+        delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _deliver(self, bot, event: Dict[str, Any]) -> Dict[str, Any]:
+        attempts = int(event.get("attempts", 0)) + 1
+        result = {"id": event["id"], "attempts": attempts, "last_error": None,
+                  "status": "sent", "next_attempt_at": time.time()}
+        await self._limiter.acquire()
         try:
-            payments = get_payments()
-            config = get_crypto_config()
-            
-            if not config or not payments:
-                time.sleep(30)
-                continue
-            
-            for p in payments:
-                if p.get("status") == "pending":
-                    uuid = p.get("uuid")
-                    if not uuid:
-                        continue
-                    
-                    new_status = get_invoice_status(uuid)
-                    if new_status and new_status not in ("pending", "unknown"):
-                        update_payment_status(uuid, new_status)
-                        logger.info(f"💰 Payment {uuid} updated: {new_status}")
+            await bot.send_message(chat_id=event["chat_id"], text=render_event(event), parse_mode=ParseMode.HTML)
+            self._limiter.success()
+            return result
+        except RetryAfter as e:
+            self._limiter.backoff(float(e.retry_after))
+            delay = float(e.retry_after)
+            result["last_error"] = f"RetryAfter {e.retry_after}"
+        except (Forbidden, BadRequest) as e:
+            result.update(status="failed", last_error=str(e))
+            return result
         except Exception as e:
-            logger.error(f"❌ Payment polling error: {e}")
-        
-        time.sleep(30)
+            delay = self._retry_delay(attempts)
+            result["last_error"] = str(e) or type(e).__name__
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            result["status"] = "failed"
+        else:
+            result.update(status="pending", next_attempt_at=time.time() + delay)
+        return result
 
-def create_invoice(user_id: int, username: str):
-    """Create new Cryptomus invoice"""
-    config = get_crypto_config()
-    if not config:
-        return None, None
-    
-    amount = get_payment_amount()
-    order_id = f"{user_id}_{int(time.time())}"
-    
-    payload = {
-        "amount": str(amount),
-        "currency": "USDT",
-        "order_id": order_id,
-        "network": "tron",
-    }
-    
-    headers = {
-        "merchant": config["merchant_id"],
-        "sign": "",
-        "Content-Type": "application/json",
-        "Authorization": config["api_key"],
-    }
-    
-    try:
-        resp = requests.post("https://api.cryptomus.com/v1/payment", 
-                            json=payload, headers=headers, timeout=20)
-        data = resp.json()
-        result = data.get("result", {}) if isinstance(data, dict) else {}
-        
-        uuid = result.get("uuid")
-        url = result.get("url")
-        
-        if uuid and url:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            add_payment(user_id, username, amount, uuid, "pending", url, now)
-            logger.info(f"💸 Invoice created for {username}: {amount} USDT")
-            return url, uuid
-        
-        logger.error(f"❌ Invoice creation failed: {data}")
-        return None, None
-    except Exception as ex:
-        logger.error(f"❌ Error creating invoice: {ex}")
-        return None, None
+    async def dispatch_once(self, bot) -> int:
+        """Deliver one batch of due events; returns how many were attempted"""
+        if self._limiter is None:
+            self._limiter = RateLimiter(OUTBOX_RATE)
+        storage = get_storage()
+        events = await run_blocking(storage.get_due_events, time.time(), OUTBOX_BATCH)
+        if not events:
+            return 0
+
+        results: List[Dict[str, Any]] = []
+
+        async def deliver(event):
+            results.append(await self._deliver(bot, event))
+
+        try:
+            await asyncio.gather(*(deliver(e) for e in events))
+        finally:
+            # Record whatever finished, even if we are being cancelled mid-batch
+            finished_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            await run_blocking(storage.finish_events, results, finished_at)
+            for r in results:
+                metrics.inc("bot_outbox_events_total", result=r["status"])
+                if r["status"] == "failed":
+                    logger.warning(f"⚠️ Outbox event {r['id']} failed permanently: {r['last_error']}")
+        return len(events)
+
+    async def run(self, bot):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.dispatch_once(bot):
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Outbox dispatch error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_IDLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+outbox_dispatcher = OutboxDispatcher()
 
 # ═══════════════════════════════════════════════════════════════════════
 # 🔐 ADMIN PANEL HANDLERS
@@ -435,7 +3592,7 @@ async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 🗑️ Remove Group
     elif choice == "🗑️ Remove Group":
-        groups = load_groups()
+        groups = await load_groups_async()
         if not groups:
             await update.message.reply_text(
                 "❌ <b>No Groups Available</b>\n\nAdd some groups first!",
@@ -463,7 +3620,7 @@ async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 📋 View All Groups
     elif choice == "📋 View All Groups":
-        groups = load_groups()
+        groups = await load_groups_async()
         if not groups:
             await update.message.reply_text("❌ <b>No Groups Available</b>", parse_mode=ParseMode.HTML)
             await show_admin_menu(update, context)
@@ -486,25 +3643,35 @@ async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 📢 Broadcast
     elif choice == "📢 Broadcast Message":
+        context.chat_data.pop("broadcast_album", None)
+        keyboard = [["⬅️ Back to Menu"]]
+        if await run_blocking(media_cache.last):
+            keyboard.insert(0, ["🔁 Repeat Last Broadcast"])
         await update.message.reply_text(
-            "📢 <b>Broadcast Message</b>\n\nEnter message to send to all users:",
-            reply_markup=ReplyKeyboardMarkup([["⬅️ Back to Menu"]], resize_keyboard=True),
+            "📢 <b>Broadcast Message</b>\n\n"
+            "Send the message to deliver to all users.\n"
+            "Text, photos, videos, documents and albums are supported.",
+            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
             parse_mode=ParseMode.HTML,
         )
         return BROADCAST_STATE
 
     # 👥 User Statistics
     elif choice == "👥 User Statistics":
-        users = get_users()
+        total_users = await count_users_async()
+        dead_users = await run_blocking(get_storage().count_dead_users)
+        recent_users = await get_recent_users_async(10)
         msg = (
             "┏━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
             "┃  👥 <b>USER STATISTICS</b> 👥  ┃\n"
             "┗━━━━━━━━━━━━━━━━━━━━━━━━━┛\n\n"
-            f"<b>Total Users:</b> {len(users)}\n\n"
+            f"<b>Total Users:</b> {total_users}\n"
+            f"✅ Reachable: {total_users - dead_users}\n"
+            f"💤 Unreachable (blocked/deleted): {dead_users}\n\n"
             "<b>Recent 10 Users:</b>\n"
         )
         
-        for idx, (uid, name, uname, ts) in enumerate(users[-10:], 1):
+        for idx, (uid, name, uname, ts) in enumerate(recent_users, 1):
             uname_txt = f"@{uname}" if uname and uname != "N/A" else "N/A"
             msg += f"{idx}. {safe_html(name)} ({uname_txt})\n    <code>{uid}</code>\n"
         
@@ -522,12 +3689,13 @@ async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 📊 Payment Statistics
     elif choice == "📊 Payment Statistics":
-        payments = get_payments()
-        total = len(payments)
-        successful = len([p for p in payments if p.get("status") == "paid"])
-        pending = len([p for p in payments if p.get("status") == "pending"])
-        failed = len([p for p in payments if p.get("status") == "failed"])
-        recent = list(reversed(payments))[:5]
+        stats = payment_ledger.stats()
+        total = stats["total"]
+        successful = stats["paid"]
+        pending = stats["pending"]
+        failed = stats["failed"]
+        recent = payment_ledger.recent(5)
+        outbox = await run_blocking(get_storage().outbox_counts)
 
         msg = (
             "┏━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
@@ -536,7 +3704,9 @@ async def handle_admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📝 Total Payments: <b>{total}</b>\n"
             f"✅ Successful: <b>{successful}</b>\n"
             f"⏳ Pending: <b>{pending}</b>\n"
-            f"❌ Failed: <b>{failed}</b>\n\n"
+            f"❌ Failed: <b>{failed}</b>\n"
+            f"📬 Notifications: <b>{outbox.get('sent', 0)}</b> sent, "
+            f"<b>{outbox.get('pending', 0)}</b> queued, <b>{outbox.get('failed', 0)}</b> failed\n\n"
             f"<b>Last 5 Transactions:</b>\n"
         )
         
@@ -573,7 +3743,7 @@ async def set_payment_amount_handler(update: Update, context: ContextTypes.DEFAU
     """Handle payment amount setting"""
     amt = (update.message.text or "").strip()
     if amt.isdigit() and int(amt) > 0:
-        set_payment_amount_value(int(amt))
+        await set_payment_amount_value_async(int(amt))
         await update.message.reply_text(
             f"✅ Payment amount set to <b>{amt} USDT</b>",
             parse_mode=ParseMode.HTML
@@ -584,33 +3754,74 @@ async def set_payment_amount_handler(update: Update, context: ContextTypes.DEFAU
     await update.message.reply_text("❌ Invalid amount. Enter a positive integer.")
     return SET_PAYMENT_AMOUNT_STATE
 
+async def launch_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, content: Dict[str, Any]):
+    """Start a broadcast of content and return to the admin menu"""
+    job = BroadcastJob.new(content, update.effective_chat.id)
+    if await start_broadcast_job(context.application, job):
+        await run_blocking(media_cache.remember, content)
+        await update.message.reply_text(
+            "🚀 <b>Broadcast Started!</b>\n\n"
+            f"Sending the {content_label(content)} in the background. Live progress will be posted here.",
+            parse_mode=ParseMode.HTML
+        )
+    else:
+        await update.message.reply_text(
+            "⏳ <b>A broadcast is already running.</b>\n\nWait for it to finish.",
+            parse_mode=ParseMode.HTML
+        )
+    await show_admin_menu(update, context)
+    return ADMIN_MENU_STATE
+
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Broadcast message to all users"""
-    text = update.message.text
+    """Broadcast the admin's message (text, media or album) to all users"""
+    message = update.message
+    text = message.text
     if text == "⬅️ Back to Menu":
+        context.chat_data.pop("broadcast_album", None)
         await show_admin_menu(update, context)
         return ADMIN_MENU_STATE
-    
-    users = get_users()
-    sent = 0
-    failed = 0
-    
-    for u in users:
-        try:
-            await context.bot.send_message(chat_id=u[0], text=text)
-            sent += 1
-            await asyncio.sleep(0.05)  # Rate limit protection
-        except Exception:
-            failed += 1
-    
-    await update.message.reply_text(
-        f"✅ <b>Broadcast Complete!</b>\n\n"
-        f"📤 Sent: {sent}\n"
-        f"❌ Failed: {failed}",
-        parse_mode=ParseMode.HTML
-    )
-    await show_admin_menu(update, context)
-    return ADMIN_MENU_STATE
+
+    if text == "🔁 Repeat Last Broadcast":
+        content = await run_blocking(media_cache.last)
+        if not content:
+            await message.reply_text("❌ There is no previous broadcast to repeat.")
+            return BROADCAST_STATE
+        return await launch_broadcast(update, context, content)
+
+    if text == "🚀 Send Album":
+        album = context.chat_data.pop("broadcast_album", None)
+        if not album:
+            await message.reply_text("❌ No album received yet. Send the album's photos or videos first.")
+            return BROADCAST_STATE
+        return await launch_broadcast(update, context, {"type": "album", "items": album["items"]})
+
+    item = broadcast_item(message)
+    if item is None:
+        await message.reply_text("❌ Unsupported message type. Send text, a photo, video, document or album.")
+        return BROADCAST_STATE
+
+    # Album parts arrive as separate messages; collect them until the admin confirms
+    if message.media_group_id:
+        if item["type"] not in ALBUM_MEDIA_TYPES:
+            await message.reply_text("❌ Albums can only contain photos, videos, documents or audio.")
+            return BROADCAST_STATE
+        album = context.chat_data.get("broadcast_album")
+        if not album or album["group_id"] != message.media_group_id:
+            album = context.chat_data["broadcast_album"] = {"group_id": message.media_group_id, "items": []}
+            await message.reply_text(
+                "📎 <b>Album received.</b>\n\nPress <b>🚀 Send Album</b> once all items are uploaded.",
+                reply_markup=ReplyKeyboardMarkup([["🚀 Send Album"], ["⬅️ Back to Menu"]], resize_keyboard=True),
+                parse_mode=ParseMode.HTML,
+            )
+        album["items"].append(item)
+        return BROADCAST_STATE
+
+    return await launch_broadcast(update, context, {
+        "type": "copy",
+        "from_chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "message": item,
+    })
 
 async def add_group_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Step 1: Get group name"""
@@ -627,9 +3838,7 @@ async def add_group_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     link = (update.message.text or "").strip()
     name = context.user_data.get("group_name", "Unnamed")
     
-    groups = load_groups()
-    groups[name] = link
-    save_groups(groups)
+    await set_group_async(name, link)
     
     await update.message.reply_text(
         f"✅ <b>Group Added Successfully!</b>\n\n"
@@ -648,10 +3857,7 @@ async def remove_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_admin_menu(update, context)
         return ADMIN_MENU_STATE
     
-    groups = load_groups()
-    if choice in groups:
-        groups.pop(choice, None)
-        save_groups(groups)
+    if await delete_group_async(choice):
         await update.message.reply_text(
             f"🗑️ <b>Group Removed!</b>\n\n{safe_html(choice)}",
             parse_mode=ParseMode.HTML
@@ -674,57 +3880,75 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Welcome message with beautiful channel button grid"""
     user = update.effective_user
-    add_user(user.id, user.first_name or "User", user.username)
+    await add_user_async(user.id, user.first_name or "User", user.username)
 
-    groups = load_groups()
-    
-    welcome_msg = (
-        "👋 <b>Welcome!</b>\n\n"
-        "🌟 <b>Professional Channel Manager Bot</b>\n\n"
-        "📋 <b>Available Channels</b>:\n"
-    )
-    
-    if not groups:
-        welcome_msg += "\n<i>❌ No channels available at the moment.</i>"
-    
-    kb = build_channels_keyboard(groups)
+    welcome_msg, kb = await get_channels_view()
     
     if update.message:
-        await update.message.reply_text(
+        sent = await update.message.reply_text(
             welcome_msg,
             reply_markup=kb,
             parse_mode=ParseMode.HTML
         )
     else:
-        await context.bot.send_message(
+        sent = await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=welcome_msg,
             reply_markup=kb,
             parse_mode=ParseMode.HTML
         )
+    remember_shown_view(sent)
 
-async def refresh_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Refresh channel list"""
-    query = update.callback_query
-    await query.answer("🔄 Refreshing channels...")
+def _callback_page(data: str) -> int:
+    """Page number from callback data like 'refresh:2' or 'page:2'"""
+    _, _, page = (data or "").partition(":")
+    return int(page) if page.isdigit() else 0
 
-    groups = load_groups()
-    
-    msg = (
-        "👋 <b>Welcome!</b>\n\n"
-        "🌟 <b>Professional Channel Manager Bot</b>\n\n"
-        "📋 <b>Available Channels</b>:\n"
-    )
-    
-    if not groups:
-        msg += "\n<i>❌ No channels available at the moment.</i>"
-    
-    kb = build_channels_keyboard(groups)
+async def show_channels_page(query, page: int):
+    """
+    Edit the message to show a channel page.
+    Skips the API call when the message already shows it, and only sends
+    a new message if editing fails for a reason other than "not modified".
+    """
+    if is_view_current(query.message, page):
+        return
+
+    msg, kb = await get_channels_view(page)
     
     try:
         await query.edit_message_text(msg, reply_markup=kb, parse_mode=ParseMode.HTML)
+        remember_shown_view(query.message, page)
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            remember_shown_view(query.message, page)
+            return
+        sent = await query.message.reply_text(msg, reply_markup=kb, parse_mode=ParseMode.HTML)
+        remember_shown_view(sent, page)
     except Exception:
-        await query.message.reply_text(msg, reply_markup=kb, parse_mode=ParseMode.HTML)
+        sent = await query.message.reply_text(msg, reply_markup=kb, parse_mode=ParseMode.HTML)
+        remember_shown_view(sent, page)
+
+async def refresh_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Refresh channel list"""
+    query = update.callback_query
+    page = _callback_page(query.data)
+
+    # Spam taps and unchanged channel lists only get the (required) answer
+    if refresh_debounced(update.effective_user.id):
+        await query.answer()
+        return
+    if is_view_current(query.message, page):
+        await query.answer("✅ Channels are up to date")
+        return
+
+    await query.answer("🔄 Refreshing channels...")
+    await show_channels_page(query, page)
+
+async def channels_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Switch to another page of the channel list"""
+    query = update.callback_query
+    await query.answer()
+    await show_channels_page(query, _callback_page(query.data))
 
 async def make_payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle payment request"""
@@ -752,9 +3976,9 @@ async def make_payment_callback(update: Update, context: ContextTypes.DEFAULT_TY
             )
         return
 
-    # Create invoice
+    # Create invoice (or reuse the user's pending one)
     amount = get_payment_amount()
-    url, uuid = create_invoice(user_id, username)
+    url, uuid = await invoice_manager.get_or_create(user_id, username, amount)
     
     if not url:
         try:
@@ -801,18 +4025,500 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Global error handler"""
     logger.error("⚠️ Exception in handler", exc_info=context.error)
 
+# ═══════════════════════════════════════════════════════════════════════
+# 🚦 ANTI-FLOOD
+# ═══════════════════════════════════════════════════════════════════════
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; each update takes one"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "throttled")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.throttled = False
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.throttled = False
+            return True
+        return False
+
+def update_flood_kind(update: Update) -> Optional[str]:
+    """Which FLOOD_*_LIMITS bucket an update draws from (None: not limited)"""
+    if update.callback_query is not None:
+        return "payment" if update.callback_query.data == "make_payment" else "callback"
+    message = update.message
+    if message is None:
+        return None
+    if message.text and message.text.startswith("/"):
+        return "command"
+    return "message"
+
+class FloodGuard:
+    """
+    Runs ahead of every handler (TypeHandler, group -1) and drops updates
+    over their user's or the process's token bucket by raising
+    ApplicationHandlerStop, so floods never reach file I/O, Cryptomus or
+    the Bot API. A throttled callback gets one empty answer per streak to
+    clear the button spinner; further excess is dropped silently.
+    Per-user buckets live in an LRU, so memory stays bounded however many
+    accounts are flooding. Kinds missing from a limits dict are unlimited.
+    """
+
+    def __init__(self, user_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 global_limits: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.user_limits = FLOOD_USER_LIMITS if user_limits is None else user_limits
+        global_limits = FLOOD_GLOBAL_LIMITS if global_limits is None else global_limits
+        self._users = LRUCache(FLOOD_TRACKED_BUCKETS)
+        self._global = {kind: TokenBucket(*limit) for kind, limit in global_limits.items()}
+        self.dropped: Counter = Counter()
+        self._reported = 0
+        self._last_report = time.monotonic()
+
+    def _drop(self, kind: str, reason: str, now: float):
+        self.dropped[(kind, reason)] += 1
+        metrics.inc("bot_updates_dropped_total", kind=kind, reason=reason)
+        if now - self._last_report >= FLOOD_REPORT_INTERVAL:
+            total = sum(self.dropped.values())
+            logger.warning(f"🚦 Flood guard dropped {total - self._reported} updates in the last {now - self._last_report:.0f}s")
+            self._reported = total
+            self._last_report = now
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        kind = update_flood_kind(update)
+        user = update.effective_user
+        if kind is None or user is None:
+            return
+        now = time.monotonic()
+        key = (user.id, kind)
+        bucket = self._users.get(key)
+        if bucket is None and kind in self.user_limits:
+            bucket = TokenBucket(*self.user_limits[kind])
+            self._users.set(key, bucket)
+
+        if bucket is not None and not bucket.take(now):
+            self._drop(kind, "user", now)
+            if update.callback_query is not None and not bucket.throttled:
+                bucket.throttled = True
+                try:
+                    await update.callback_query.answer("⏳ Too many requests, slow down")
+                except Exception:
+                    pass
+            raise ApplicationHandlerStop
+        global_bucket = self._global.get(kind)
+        if global_bucket is not None and not global_bucket.take(now):
+            self._drop(kind, "global", now)
+            raise ApplicationHandlerStop
+
+flood_guard = FloodGuard()
+
+# ═══════════════════════════════════════════════════════════════════════
+# 🧩 MULTI-WORKER MODE
+# ═══════════════════════════════════════════════════════════════════════
+
+def singleton_jobs(application) -> list:
+    """Background jobs exactly one process runs (the leader in multi-worker mode)"""
+    return [
+        poll_payments(),
+        outbox_dispatcher.run(application.bot),
+        reachability_prober.run(application.bot),
+    ]
+
+class LeaderElection:
+    """
+    Keeps the "leader" lease in the shared database. The holder runs the
+    singleton jobs (payment poller, Cryptomus webhook, notification
+    outbox, dead-recipient re-probe, resuming orphaned broadcasts); when
+    it dies another worker takes over after the lease expires.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.is_leader = False
+        self._renewed = 0.0
+        self._tasks: List["asyncio.Task"] = []
+
+    def _cancel_tasks(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _start_services(self):
+        logger.info(f"👑 {WORKER_ID} is now the leader")
+        self._tasks = [self.application.create_task(job) for job in singleton_jobs(self.application)]
+        try:
+            await start_cryptomus_webhook()
+        except Exception as e:
+            logger.error(f"❌ Cryptomus webhook failed to start: {e}")
+
+    async def _stop_services(self):
+        logger.warning(f"⚠️ {WORKER_ID} lost leadership")
+        self._cancel_tasks()
+        await stop_cryptomus_webhook()
+
+    def resign(self):
+        """Give the lease up right away (clean shutdown) so another worker can take over"""
+        if self.is_leader:
+            self.is_leader = False
+            self._cancel_tasks()
+            try:
+                get_storage().release_lease("leader", WORKER_ID)
+            except Exception as e:
+                logger.warning(f"⚠️ Leader lease release failed: {e}")
+
+    async def run(self):
+        storage = get_storage()
+        try:
+            while True:
+                try:
+                    acquired = await run_blocking(storage.acquire_lease, "leader", WORKER_ID, LEADER_LEASE_TTL)
+                    if acquired:
+                        self._renewed = time.monotonic()
+                except Exception as e:
+                    logger.error(f"❌ Leader lease error: {e}")
+                    # Step down before our last renewal can expire and another worker takes over
+                    acquired = (self.is_leader and
+                                time.monotonic() - self._renewed < LEADER_LEASE_TTL - LEADER_RENEW_INTERVAL)
+
+                if acquired and not self.is_leader:
+                    self.is_leader = True
+                    await self._start_services()
+                elif not acquired and self.is_leader:
+                    self.is_leader = False
+                    await self._stop_services()
+                if self.is_leader:
+                    await resume_broadcast(self.application)
+                await asyncio.sleep(LEADER_RENEW_INTERVAL)
+        finally:
+            self.resign()
+
+leader_election: Optional[LeaderElection] = None
+
+async def shared_state_sync():
+    """Worker mode: pick up payments and channel edits written by other workers"""
+    storage = get_storage()
+    last_version = None
+    while True:
+        await asyncio.sleep(SHARED_SYNC_INTERVAL)
+        try:
+            version = await run_blocking(storage.data_version)
+            if version == last_version:
+                continue
+            last_version = version
+            await payment_ledger.sync_async()
+            groups = await run_blocking(storage.load_groups)
+            if groups != await load_groups_async():
+                config_cache.invalidate("groups")
+        except Exception as e:
+            logger.error(f"❌ Shared state sync error: {e}")
+
+def update_shard_key(update: Dict[str, Any]) -> int:
+    """Chat id of a raw update (sender id if it has no chat); picks the update's worker"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat") or {}
+        sender = value.get("from") or value.get("user") or {}
+        return int(chat.get("id") or sender.get("id") or 0)
+    return 0
+
+class UpdateRouter:
+    """
+    Front process of multi-worker mode.
+    Each webhook update is written as one JSON line to the stdin of worker
+    chat_id % N, so a chat's updates are always handled, in order, by the
+    same worker. Workers that exit are restarted; updates for a worker
+    that is down get 503 so Telegram redelivers them.
+    """
+
+    def __init__(self, workers: int, secret: str):
+        self.workers = workers
+        self.secret = secret
+        self.procs: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self._tasks: List["asyncio.Task"] = []
+        self._stopping = False
+
+    async def _keep_alive(self, index: int):
+        env = dict(os.environ, BOT_WORKER_INDEX=str(index))
+        while not self._stopping:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), stdin=asyncio.subprocess.PIPE, env=env,
+            )
+            self.procs[index] = proc
+            logger.info(f"🧩 Worker {index} started (pid {proc.pid})")
+            code = await proc.wait()
+            if self._stopping:
+                return
+            logger.error(f"❌ Worker {index} exited with code {code}, restarting")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._keep_alive(i)) for i in range(self.workers)]
+
+    async def handle_update(self, body: bytes, headers: Dict[str, str]):
+        if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), self.secret):
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = json.loads(body.decode("utf-8"))
+            shard = update_shard_key(update) % self.workers
+        except (ValueError, TypeError, AttributeError):
+            return 400, "text/plain", b"bad update"
+
+        proc = self.procs[shard]
+        if proc is None or proc.returncode is not None:
+            return 503, "text/plain", b"worker unavailable"
+        try:
+            proc.stdin.write(json.dumps(update, separators=(",", ":")).encode("utf-8") + b"\n")
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return 503, "text/plain", b"worker unavailable"
+        return 200, "text/plain", b"ok"
+
+    async def stop(self):
+        """Close worker stdins; workers finish their queued updates and exit"""
+        self._stopping = True
+        for proc in self.procs:
+            if proc is not None and proc.returncode is None:
+                proc.stdin.close()
+        for proc in self.procs:
+            if proc is None:
+                continue
+            try:
+                await asyncio.wait_for(proc.wait(), 30)
+            except asyncio.TimeoutError:
+                proc.terminate()
+                await proc.wait()
+        for task in self._tasks:
+            task.cancel()
+
+async def _run_front(bot_token: str, config: Dict[str, Any], workers: int):
+    secret = webhook_secret(bot_token, config)
+    webhook_url = config.get("webhook_url")
+    url_path = config.get("url_path") or (urlparse(webhook_url).path if webhook_url else "telegram")
+    router = UpdateRouter(workers, secret)
+    # Plain HTTP: terminate TLS in front of this port (Telegram only calls https:// webhooks)
+    server = MiniHTTPServer(config.get("listen", "0.0.0.0"), int(config.get("port", 8443)))
+    server.route("POST", "/" + url_path.lstrip("/"), router.handle_update)
+
+    router.start()
+    await server.start()
+    if webhook_url:
+        bot = Bot(bot_token, base_url=config.get("api_base_url") or "https://api.telegram.org/bot")
+        async with bot:
+            await bot.set_webhook(
+                url=webhook_url,
+                secret_token=secret,
+                max_connections=int(config.get("max_connections", 100)),
+                drop_pending_updates=bool(config.get("drop_pending_updates", False)),
+            )
+    print(f"📡 Update delivery: webhook front, {workers} workers on port {config.get('port', 8443)}")
+    startup.mark("front ready")
+    startup.report()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
+
+    print("\n🛑 Stopping workers...")
+    await server.stop()
+    await router.stop()
+
+def run_front(bot_token: str, config: Dict[str, Any], workers: int):
+    """Front process: webhook receiver spreading updates over worker processes"""
+    asyncio.get_event_loop().run_until_complete(_run_front(bot_token, config, workers))
+
+async def _run_worker(app):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    logger.info(f"🧩 {WORKER_ID} ready")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                update = Update.de_json(json.loads(line), app.bot)
+            except Exception as e:
+                logger.warning(f"⚠️ Dropping malformed update: {e}")
+                continue
+            await app.update_queue.put(update)
+    finally:
+        # stop() handles everything already queued before returning
+        await app.stop()
+        background = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await app.shutdown()
+        await post_shutdown(app)
+
+def run_worker(app):
+    """Worker process: handle the updates the front process writes to stdin"""
+    # Ctrl+C reaches the whole process group; the front shuts workers down via EOF
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.get_event_loop().run_until_complete(_run_worker(app))
+
 # ═══════════════════════════════════════════════════════════════════════
 # 🚀 MAIN APPLICATION
 # ═══════════════════════════════════════════════════════════════════════
 
+def get_bot_config() -> Dict[str, Any]:
+    """Get update delivery settings (empty means long polling)"""
+    if not os.path.isfile(BOT_CONFIG_FILE):
+        return {}
+    data = load_json(BOT_CONFIG_FILE, {})
+    return data if isinstance(data, dict) else {}
+
+def webhook_secret(bot_token: str, config: Dict[str, Any]) -> str:
+    """Configured secret token, or one derived from the bot token so all instances agree"""
+    secret = str(config.get("secret_token") or "")
+    if secret:
+        return secret
+    return hashlib.sha256(f"webhook:{bot_token}".encode("utf-8")).hexdigest()[:48]
+
+def run_bot(app, bot_token: str):
+    """Deliver updates via webhook when configured, otherwise via long polling"""
+    config = get_bot_config()
+    if config.get("mode") == "webhook":
+        webhook_url = config.get("webhook_url")
+        if not webhook_url:
+            problem = "webhook_url is missing"
+        elif importlib.util.find_spec("tornado") is None:
+            problem = "python-telegram-bot[webhooks] is not installed"
+        else:
+            problem = None
+
+        if problem is None:
+            url_path = config.get("url_path") or urlparse(webhook_url).path.lstrip("/")
+            print(f"📡 Update delivery: webhook ({webhook_url})")
+            app.run_webhook(
+                listen=config.get("listen", "0.0.0.0"),
+                port=int(config.get("port", 8443)),
+                url_path=url_path,
+                webhook_url=webhook_url,
+                secret_token=webhook_secret(bot_token, config),
+                max_connections=int(config.get("max_connections", 100)),
+                cert=config.get("cert"),
+                key=config.get("key"),
+                drop_pending_updates=bool(config.get("drop_pending_updates", False)),
+            )
+            return
+        logger.warning(f"⚠️ Webhook mode unavailable ({problem}), falling back to polling")
+
+    print("📡 Update delivery: long polling")
+    app.run_polling()
+
+async def post_init(application):
+    """Start background jobs once the application is initialized"""
+    global leader_election
+    startup.mark("initialize")
+    if LOOP_DEBUG:
+        enable_loop_debug(asyncio.get_running_loop())
+    await start_metrics_server()
+    application.create_task(config_cache.watch())
+    application.create_task(storage_maintenance())
+    if WORKER_INDEX is not None:
+        # Singleton jobs run on whichever worker holds the leader lease
+        leader_election = LeaderElection(application)
+        application.create_task(shared_state_sync())
+        application.create_task(leader_election.run())
+    else:
+        await start_cryptomus_webhook()
+        for job in singleton_jobs(application):
+            application.create_task(job)
+        await resume_broadcast(application)
+    startup.mark("post_init")
+    startup.report()
+
+async def post_shutdown(application):
+    """Release shared network resources"""
+    if leader_election is not None:
+        leader_election.resign()
+    await stop_cryptomus_webhook()
+    await stop_metrics_server()
+    await cryptomus.close()
+    shutdown_executors()
+    get_storage().close()
+
+def register_handlers(app):
+    """Register all handlers; wraps them with latency metrics when enabled"""
+    if metrics.enabled:
+        h = instrument_handler
+    else:
+        h = lambda name, callback: callback
+
+    # Admin conversation handler
+    admin_conv = ConversationHandler(
+        entry_points=[CommandHandler("admin", h("admin_cmd", admin_cmd))],
+        states={
+            PASSWORD_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("check_password", check_password))],
+            ADMIN_MENU_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("handle_admin_menu", handle_admin_menu))],
+            ADD_GROUP_NAME_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("add_group_name", add_group_name))],
+            ADD_GROUP_LINK_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("add_group_link", add_group_link))],
+            REMOVE_GROUP_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("remove_group", remove_group))],
+            BROADCAST_STATE: [MessageHandler(
+                (filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.VIDEO | filters.ANIMATION
+                | filters.Document.ALL | filters.AUDIO | filters.VOICE,
+                h("broadcast", broadcast),
+            )],
+            SET_PAYMENT_AMOUNT_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, h("set_payment_amount", set_payment_amount_handler))],
+        },
+        fallbacks=[CommandHandler("cancel", h("cancel", cancel))],
+        name="admin_conv",
+        persistent=app.persistence is not None,
+    )
+
+    # Register handlers (the flood guard runs first and can stop an update)
+    app.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    app.add_handler(CommandHandler("start", h("start", start)))
+    app.add_handler(admin_conv)
+    # Non-blocking: a slow Cryptomus call must not hold up other chats' updates
+    app.add_handler(CallbackQueryHandler(h("make_payment", make_payment_callback), pattern="^make_payment$", block=False))
+    app.add_handler(CallbackQueryHandler(h("refresh", refresh_callback), pattern=r"^refresh(:\d+)?$"))
+    app.add_handler(CallbackQueryHandler(h("channels_page", channels_page_callback), pattern=r"^page:\d+$"))
+    app.add_error_handler(error_handler)
+
+def application_builder(token: str, bot_config: Dict[str, Any]) -> ApplicationBuilder:
+    """Production Application settings (shared with the benchmarks)"""
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .read_timeout(30)
+        .write_timeout(30)
+        .connect_timeout(30)
+        .pool_timeout(30)
+        .persistence(SQLitePersistence(PERSISTENCE_FILE))
+    )
+    if bot_config.get("api_base_url"):
+        builder = builder.base_url(bot_config["api_base_url"])
+    return builder
+
 def main():
     """Main application entry point"""
     
-    print("\n" + "═" * 70)
-    print("║                                                                  ║")
-    print("║       🌟 Professional Channel Manager Bot with Payments 🌟      ║")
-    print("║                                                                  ║")
-    print("═" * 70)
+    if WORKER_INDEX is None:
+        print("\n" + "═" * 70)
+        print("║                                                                  ║")
+        print("║       🌟 Professional Channel Manager Bot with Payments 🌟      ║")
+        print("║                                                                  ║")
+        print("═" * 70)
     
     # Load or request bot token
     token_file = "bot_token.txt"
@@ -828,6 +4534,21 @@ def main():
         print("✅ Token saved to bot_token.txt")
 
     ensure_files()
+    get_storage()
+    startup.mark("config & storage")
+
+    # Multi-worker mode: this process only receives updates and supervises workers
+    bot_config = get_bot_config()
+    workers = int(bot_config.get("workers", 1) or 1)
+    if WORKER_INDEX is None and workers > 1:
+        if STORAGE_BACKEND == "sqlite":
+            run_front(BOT_TOKEN, bot_config, workers)
+            return
+        logger.warning("⚠️ Multiple workers need the SQLite storage backend, running a single process")
+
+    payment_ledger.ensure_loaded()
+    metrics.enabled = bool(METRICS_PORT)
+    startup.mark("payment ledger")
 
     # Check Cryptomus configuration
     if not get_crypto_config():
@@ -837,42 +4558,17 @@ def main():
         print("\n💡 Bot will start, but payments won't work until configured.\n")
 
     # Build application
-    app = (
-        ApplicationBuilder()
-        .token(BOT_TOKEN)
-        .read_timeout(30)
-        .write_timeout(30)
-        .connect_timeout(30)
-        .pool_timeout(30)
-        .build()
-    )
-
-    # Admin conversation handler
-    admin_conv = ConversationHandler(
-        entry_points=[CommandHandler("admin", admin_cmd)],
-        states={
-            PASSWORD_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_password)],
-            ADMIN_MENU_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_menu)],
-            ADD_GROUP_NAME_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_group_name)],
-            ADD_GROUP_LINK_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_group_link)],
-            REMOVE_GROUP_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, remove_group)],
-            BROADCAST_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast)],
-            SET_PAYMENT_AMOUNT_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_payment_amount_handler)],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        name="admin_conv",
-        persistent=False,
-    )
+    builder = application_builder(BOT_TOKEN, bot_config).post_init(post_init).post_shutdown(post_shutdown)
+    if WORKER_INDEX is not None:
+        builder = builder.updater(None)
+    app = builder.build()
 
-    # Register handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(admin_conv)
-    app.add_handler(CallbackQueryHandler(make_payment_callback, pattern="^make_payment$"))
-    app.add_handler(CallbackQueryHandler(refresh_callback, pattern="^refresh$"))
-    app.add_error_handler(error_handler)
+    register_handlers(app)
+    startup.mark("build application")
 
-    # Start payment polling thread
-    threading.Thread(target=poll_payments, daemon=True).start()
+    if WORKER_INDEX is not None:
+        run_worker(app)
+        return
 
     print("\n" + "═" * 70)
     print("✅ Bot is running successfully!")
@@ -883,12 +4579,19 @@ def main():
     print("═" * 70 + "\n")
 
     # Start bot
-    app.run_polling()
+    run_bot(app, BOT_TOKEN)
+
+startup.mark("module init")
 
 if __name__ == "__main__":
     import asyncio
     import sys
 
+    # python main.py --test-webhook <uuid> [status]  -> post a signed sample callback
+    if len(sys.argv) >= 3 and sys.argv[1] == "--test-webhook":
+        send_test_webhook(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "paid")
+        sys.exit(0)
+
     # Fix for Python 3.10+ and especially 3.14 event loop issue
     if sys.platform == 'win32':
         # Windows needs WindowsSelectorEventLoopPolicy